@@ -0,0 +1,86 @@
+import os
+import argparse
+import logging
+import sys
+import pysam
+
+from txseq.tasks.bam import is_spliced
+
+
+# <------------------------------ Logging ------------------------------------>
+
+L = logging.getLogger(__name__)
+log_handler = logging.StreamHandler(sys.stdout)
+log_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+log_handler.setLevel(logging.INFO)
+L.addHandler(log_handler)
+L.setLevel(logging.INFO)
+
+# <------------------------------ Arguments ---------------------------------->
+
+L.info("parsing arguments")
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--bam", default=None, type=str,
+                    help=("The path to the BAM file"))
+parser.add_argument("--threads", default=1, type=int,
+                    help=("The number of BAM decompression threads"))
+parser.add_argument("--outfile", default=None, type=str,
+                    help=("name of the outfile"))
+
+args = parser.parse_args()
+
+L.info("Running with arguments:")
+print(args)
+
+
+# <--------------------------- Sanity checks(s) ------------------------------>
+
+if not os.path.exists(args.bam):
+    raise ValueError("BAM file: " + args.bam + " does not exist")
+
+
+# <----------------------- Count the spliced reads --------------------------->
+
+# * paired-endedness is ignored
+# * only uniquely mapping (NH == 1) reads are considered
+
+L.info("counting uniquely mapped spliced and unspliced reads")
+
+spliced = 0
+unspliced = 0
+
+with pysam.AlignmentFile(args.bam, "rb", threads=args.threads) as bam:
+
+    for read in bam.fetch(until_eof=True):
+
+        if read.is_unmapped:
+            continue
+
+        try:
+            if read.get_tag("NH") != 1:
+                continue
+        except KeyError:
+            continue
+
+        if is_spliced(read):
+            spliced += 1
+        else:
+            unspliced += 1
+
+# a BAM without uniquely mapped reads (e.g. a failed sample) gets nan
+total = spliced + unspliced
+
+if total > 0:
+    fraction_spliced = spliced / total
+else:
+    L.warning("no uniquely mapped reads found")
+    fraction_spliced = float("nan")
+
+L.info("Saving the result")
+
+with open(args.outfile, "w") as out_file:
+    out_file.write("fraction_spliced\n")
+    out_file.write("%s\n" % fraction_spliced)
+
+L.info("complete")
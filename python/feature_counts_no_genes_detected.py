@@ -43,35 +43,45 @@ if not os.path.exists(args.database):
     
 # <--------------------------- Calculate QC stats ----------------------------->
 
-L.info("fetching the data from the database")
+# the sample, gene and value columns of the long format table
+COLUMNS = {"sample_col": "track", "gene_col": "gene_id", "value_col": "counts"}
+
+L.info("counting the genes detected in each sample")
 
 con = sqlite3.connect(args.database)
 
-c = con.cursor()
+statement = '''select q.%(sample_col)s sample_id, i.gene_biotype,
+                      count(*) n_genes
+               from %(table)s q
+               inner join (select distinct gene_id, gene_biotype
+                           from transcript_info) i
+               on q.%(gene_col)s=i.gene_id
+               where q.%(value_col)s > 0
+               group by q.%(sample_col)s, i.gene_biotype
+            ''' % dict(vars(args), **COLUMNS)
 
-statement = '''select distinct h.*, gene_biotype
-                   from %(table)s h
-                   inner join transcript_info i
-                   on h.gene_id=i.gene_id
-               ''' % vars(args)
+df = pd.read_sql(statement, con)
 
-melted_df = pd.read_sql(statement, con)
+# report every sample and biotype, including those with no genes detected
+samples = pd.read_sql('''select distinct %(sample_col)s sample_id
+                         from %(table)s''' % dict(vars(args), **COLUMNS),
+                      con)["sample_id"]
 
-L.info("Calculating no. genes per sample")
-grouped_df = melted_df.groupby(["gene_biotype", "track"])
+biotypes = pd.read_sql('''select distinct gene_biotype
+                          from transcript_info''', con)["gene_biotype"]
 
-# print(grouped_df.head())
+con.close()
 
-agg_df = grouped_df.agg({"counts": lambda x:
-                            np.sum([1 for y in x if y > 0])})
-agg_df.reset_index(inplace=True)
+count_df = df.pivot(index="sample_id", columns="gene_biotype",
+                    values="n_genes")
+count_df = count_df.reindex(index=sorted(samples),
+                            columns=sorted(biotypes.dropna()))
+count_df = count_df.fillna(0).astype(int)
 
-count_df = pd.pivot_table(agg_df, index="track",
-                            values="counts", columns="gene_biotype")
-count_df["total"] = count_df.apply(np.sum, 1)
+count_df["total"] = count_df.sum(axis=1)
 count_df["sample_id"] = count_df.index
 
 L.info("Saving the result")
 count_df.to_csv(args.outfile, index=False, sep="\t")
 
-L.info("complete")
\ No newline at end of file
+L.info("complete")
@@ -3,9 +3,9 @@ import re
 import argparse
 import logging
 import sys
-import sqlite3
 import pandas as pd
-import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 
 # <------------------------------ Logging ------------------------------------>
@@ -22,10 +22,9 @@ L.setLevel(logging.INFO)
 L.info("parsing arguments")
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--database", default="csvdb", type=str,
-                    help=("The path to the sqlite database"))
-parser.add_argument("--table", default=None, type=str,
-                    help=("The table name"))
+parser.add_argument("--countfiles", default=None, type=str,
+                    help=("A comma separated list of the per-sample "
+                          "[sample_id].counts.gz files"))
 parser.add_argument("--outfile", default=None, type=str,
                     help=("name of the gzip compressed outfile"))
 
@@ -37,42 +36,41 @@ print(args)
 
 # <--------------------------- Sanity checks(s) ------------------------------>
 
-if not os.path.exists(args.database):
-    raise ValueError("Database file: " + args.ensemblgtf + " does not exist")
+count_files = [x.strip() for x in args.countfiles.split(",")]
+
+for count_file in count_files:
+    if not os.path.exists(count_file):
+        raise ValueError("Counts file: " + count_file + " does not exist")
 
   
 # <--------------------------- fetch the counts ------------------------------>
 
-L.info("fetching the data from the database")
-
-con = sqlite3.connect(args.database)
-
-c = con.cursor()
+L.info("reading the counts from %i files" % len(count_files))
 
-sql = '''select track, gene_id, counts
-             from %(table)s t
-          ''' % vars(args)
+counts = []
 
-df = pd.read_sql(sql, con)
+for count_file in count_files:
 
-L.info("pivoting to a wide table")
+    sample_id = os.path.basename(count_file)[:-len(".counts.gz")]
 
-# df = df.pivot(index="gene_id", columns="track", values="counts")
-# df.to_csv(outfile, sep="\t", index=True, index_label="gene_id")
+    # the pyarrow reader is multi-threaded and decompresses the
+    # (bgzip) file itself based on the .gz extension
+    table = pacsv.read_csv(
+        count_file,
+        read_options=pacsv.ReadOptions(column_names=["gene_id", "counts"]),
+        parse_options=pacsv.ParseOptions(delimiter="\t"),
+        convert_options=pacsv.ConvertOptions(
+            column_types={"gene_id": pa.string(), "counts": pa.int32()}))
 
+    sample_counts = table.to_pandas(self_destruct=True, split_blocks=True)
+    sample_counts = sample_counts.set_index("gene_id")["counts"]
 
-out_df = pd.DataFrame(index=[x for x in df["gene_id"].unique()])
+    counts.append(sample_counts.rename(sample_id))
 
-for sample in [x for x in df["track"].unique()]:
+L.info("joining to a wide table")
 
-    sample_df = df[df["track"]==sample].copy()
-    sample_df.index = sample_df["gene_id"]
-    
-    out_df[sample] = np.NaN
-    out_df.loc[sample_df.index, sample] = sample_df["counts"]
-    
-out_df = out_df.astype(int)
+out_df = pd.concat(counts, axis=1)
 
 out_df.to_csv(args.outfile, sep="\t", index=True, index_label="gene_id")
 
-L.info("complete")
\ No newline at end of file
+L.info("complete")
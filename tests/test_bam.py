@@ -0,0 +1,40 @@
+'''test_bam - test the BAM helper functions
+===========================================
+
+Purpose
+-------
+
+Check the spliced read test shared by the fraction spliced metrics
+of the bamqc pipeline (python/bam_fraction_spliced.py) and of the
+deprecated pipelines (PipelineScRnaseq.countUniqueReads).
+
+'''
+from collections import namedtuple
+
+from txseq.tasks.bam import is_spliced
+
+
+# stands in for a pysam.AlignedSegment
+Read = namedtuple("Read", ["cigartuples"])
+
+# CIGAR operation codes
+M, I, D, N, S = 0, 1, 2, 3, 4
+
+
+def test_is_spliced():
+    '''reads with a skipped region (N) are spliced
+    '''
+
+    assert is_spliced(Read([(M, 50), (N, 1000), (M, 50)]))
+    assert is_spliced(Read([(S, 5), (M, 45), (N, 200), (M, 30), (S, 2)]))
+
+
+def test_is_not_spliced():
+    '''reads without a skipped region are not spliced
+    '''
+
+    assert not is_spliced(Read([(M, 100)]))
+    assert not is_spliced(Read([(M, 40), (I, 2), (M, 30), (D, 3), (M, 28)]))
+
+    # unmapped reads have no CIGAR
+    assert not is_spliced(Read(None))
@@ -1,25 +1,229 @@
 import sys
 import os
 import re
+import csv
 import sqlite3
+from functools import lru_cache
+from typing import NamedTuple
 
 import pandas as pd
 import numpy as np
+import pysam
+from numba import njit
 
 from cgatcore import experiment as E
 from cgatcore import pipeline as P
 
-# load options from the config file
-PARAMS = P.get_parameters(
-    ["%s/pipeline.yml" % os.path.splitext(__file__)[0],
-     "../pipeline.yml",
-     "pipeline.yml"])
+from txseq.tasks.bam import is_spliced
 
 
 # ########################################################################### #
 # ####################### General functions ################################# #
 # ########################################################################### #
 
+@lru_cache(maxsize=None)
+def getParameters():
+    '''
+    Load the options from the config file.
+
+    The options are parsed on first use rather than at import so that
+    the P.submit() jobs that import this module do not re-read the
+    configuration files.
+    '''
+
+    return P.get_parameters(
+        ["%s/pipeline.yml" % os.path.splitext(__file__)[0],
+         "../pipeline.yml",
+         "pipeline.yml"])
+
+
+def connect(database):
+    '''
+    Connect to the project database, with pragmas set for the
+    read-heavy queries used to build the summary tables.
+
+    The pragmas only apply to this connection. WAL journaling is not
+    enabled as it is unreliable on network file systems.
+    '''
+
+    con = sqlite3.connect(database)
+
+    c = con.cursor()
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA cache_size=-200000")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.close()
+
+    return con
+
+
+def bulkLoad(infiles, outfile, database, regex_filename,
+             cat="sample_id", index_cols=(), chunk_size=10000):
+    '''
+    Concatenate tab-separated tables into a single database table.
+
+    The rows of all the files are inserted inside one transaction in
+    batches of `chunk_size` rows and the indexes are only created once
+    the table has been filled. The `cat` column is populated from the
+    first group of `regex_filename`, which may be a string or a compiled
+    pattern. Column affinities are taken from the first data row of the
+    first file. The table is named after `outfile`, which is written as
+    a log of the load.
+    '''
+
+    table = P.to_table(outfile)
+    rx = re.compile(regex_filename)
+
+    def _affinity(value):
+        for cast, affinity in ((int, "INTEGER"), (float, "REAL")):
+            try:
+                cast(value)
+                return affinity
+            except ValueError:
+                pass
+        return "TEXT"
+
+    con = connect(database)
+    c = con.cursor()
+
+    header = None
+    nrows = 0
+
+    c.execute("BEGIN TRANSACTION")
+    c.execute("DROP TABLE IF EXISTS %(table)s" % locals())
+
+    for infile in infiles:
+
+        track = rx.search(infile).groups()[0]
+
+        with open(infile, "r") as fh:
+
+            reader = csv.reader(fh, delimiter="\t")
+            file_header = next(reader, None)
+
+            if file_header is None:
+                continue
+
+            rows = ([track] + row for row in reader if row)
+
+            first = next(rows, None)
+            if first is None:
+                continue
+
+            if header is None:
+                header = [cat] + file_header
+                columns = ", ".join(
+                    "\"%s\" %s" % (name, _affinity(value))
+                    for name, value in zip(header, first))
+
+                c.execute("CREATE TABLE %(table)s (%(columns)s)" % locals())
+
+                insert = "INSERT INTO %s VALUES (%s)" % (
+                    table, ",".join("?" * len(header)))
+
+            elif [cat] + file_header != header:
+                raise ValueError("Column mismatch in %s" % infile)
+
+            chunk = [first]
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    c.executemany(insert, chunk)
+                    nrows += len(chunk)
+                    chunk = []
+
+            c.executemany(insert, chunk)
+            nrows += len(chunk)
+
+    con.commit()
+
+    if header is not None:
+        for col in index_cols:
+            c.execute("CREATE INDEX %(table)s_%(col)s ON %(table)s(\"%(col)s\")"
+                      % locals())
+        con.commit()
+
+    con.close()
+
+    with open(outfile, "w") as out_file:
+        out_file.write("loaded %i rows from %i files into %s\n"
+                       % (nrows, len(infiles), table))
+
+
+class LibraryParameters(NamedTuple):
+    '''
+    Endedness and strandedness derived tool options for the run.
+    '''
+
+    paired: bool
+    strand: str
+    hisat_strand_param: str
+    cufflinks_strand: str
+    featurecounts_strand: str
+    picard_strand: str
+    salmon_libtype: str
+
+
+def libraryParameters(paired, strandedness):
+    '''
+    Validate the "paired" and "strandedness" options and derive the
+    tool specific strand settings from them.
+    '''
+
+    # Determine endedness
+    if str(paired).lower() in ("1", "true", "yes"):
+        paired = True
+    elif str(paired).lower() in ("0", "false", "no"):
+        paired = False
+    else:
+        raise ValueError("Endedness not recognised")
+
+    # set options based on strandedness
+    strand = str(strandedness).lower()
+
+    if strand == "none":
+        hisat_strand = None
+        cufflinks_strand = "fr-unstranded"
+        featurecounts_strand = "0"
+        picard_strand = "NONE"
+        salmon_strand = "U"
+
+    elif strand == "forward":
+        hisat_strand = "FR" if paired else "F"
+        cufflinks_strand = "fr-secondstrand"
+        featurecounts_strand = "1"
+        picard_strand = "FIRST_READ_TRANSCRIPTION_STRAND"
+        salmon_strand = "SF"
+
+    elif strand == "reverse":
+        hisat_strand = "RF" if paired else "R"
+        cufflinks_strand = "fr-firststrand"
+        featurecounts_strand = "2"
+        picard_strand = "SECOND_READ_TRANSCRIPTION_STRAND"
+        salmon_strand = "SR"
+
+    else:
+        raise ValueError("Strand not recognised")
+
+    if hisat_strand is None:
+        hisat_strand_param = ""
+    else:
+        hisat_strand_param = "--rna-strandness %s" % hisat_strand
+
+    if paired:
+        salmon_libtype = "I" + salmon_strand
+    else:
+        salmon_libtype = salmon_strand
+
+    return LibraryParameters(paired=paired,
+                             strand=strand,
+                             hisat_strand_param=hisat_strand_param,
+                             cufflinks_strand=cufflinks_strand,
+                             featurecounts_strand=featurecounts_strand,
+                             picard_strand=picard_strand,
+                             salmon_libtype=salmon_libtype)
+
+
 def runCuffNorm(geneset, cxb_files, labels,
                 outdir, logFile,
                 library_type="fr-unstranded",
@@ -28,8 +232,15 @@ def runCuffNorm(geneset, cxb_files, labels,
                 hits="total"):
     '''
     Run cuffnorm.
+
+    The `cxb_files` (one entry per condition, replicates comma separated)
+    and `labels` lists are written to list files in the output directory
+    and expanded by the shell so that the job statement stays short for
+    large numbers of cells.
     '''
 
+    PARAMS = getParameters()
+
     total_mem = PARAMS["cufflinks_cuffnorm_total_mb_memory"]
 
     job_threads = PARAMS["cufflinks_cuffnorm_threads"]
@@ -42,20 +253,170 @@ def runCuffNorm(geneset, cxb_files, labels,
     else:
         norm_standards = ""
 
-    statement = ''' gtf=`mktemp -p %(local_tmpdir)s`;
-                    checkpoint;
-                    zcat %(geneset)s > $gtf;
-                    checkpoint;
-                    cuffnorm
+    cxb_list = os.path.join(outdir, "cxb.list")
+    labels_list = os.path.join(outdir, "labels.list")
+
+    with open(cxb_list, "w") as list_file:
+        list_file.write("\n".join(cxb_files) + "\n")
+
+    with open(labels_list, "w") as list_file:
+        list_file.write("\n".join(labels) + "\n")
+
+    # the geneset is expected to be an uncompressed GTF
+    statement = ''' cuffnorm
                         --output-dir %(outdir)s
                         --num-threads=%(job_threads)s
                         --library-type %(library_type)s
                         %(hits_method)s
                         --library-norm-method %(normalisation)s
                         %(norm_standards)s
-                        --labels %(labels)s
-                        $gtf %(cxb_files)s > %(logFile)s;
-                     checkpoint;
-                     rm $gtf;
+                        --labels $(paste -sd, %(labels_list)s)
+                        %(geneset)s $(cat %(cxb_list)s) > %(logFile)s;
                 '''
     P.run(statement)
+
+
+def splitPicardOutput(picard_out, summary_out, histogram_out=None,
+                      summary_lines=2):
+    '''
+    Split a Picard metrics file into its summary and histogram sections.
+
+    Empty and comment lines are dropped. The summary is made from the
+    first `summary_lines` lines of the metrics section (all of them if
+    `summary_lines` is None), and the histogram from the lines
+    following the "## HISTOGRAM" header. An empty histogram is written
+    if Picard did not produce one.
+    '''
+
+    summary = []
+    histogram = []
+    in_histogram = False
+
+    with open(picard_out, "r") as picard_file:
+
+        for line in picard_file:
+
+            if line.startswith("## HISTOGRAM"):
+                in_histogram = True
+                continue
+
+            if line.strip() == "" or line.startswith("#"):
+                continue
+
+            if in_histogram:
+                histogram.append(line)
+            else:
+                summary.append(line)
+
+    if summary_lines is not None:
+        summary = summary[:summary_lines]
+
+    with open(summary_out, "w") as out_file:
+        out_file.writelines(summary)
+
+    if histogram_out is not None:
+        with open(histogram_out, "w") as out_file:
+            out_file.writelines(histogram)
+
+
+@njit(cache=True)
+def threePrimeBiasSums(position, coverage):
+    '''
+    Accumulate the three prime (70-90%) and transcript body (20-90%)
+    coverage sums and counts from a Picard coverage histogram in a
+    single pass.
+    '''
+
+    tp_sum = 0.0
+    tp_n = 0
+    body_sum = 0.0
+    body_n = 0
+
+    for i in range(position.shape[0]):
+
+        x = position[i]
+
+        if x > 20 and x < 90:
+            body_sum += coverage[i]
+            body_n += 1
+
+            if x > 70:
+                tp_sum += coverage[i]
+                tp_n += 1
+
+    return tp_sum, tp_n, body_sum, body_n
+
+
+def countUniqueReads(infiles, outfiles, spikein_pattern="ERCC", threads=4):
+    '''
+    Count the reads mapping uniquely to the spike-ins and to the genome,
+    and the fraction of uniquely mapping reads that are spliced, in a
+    single pass over the BAM file.
+
+    The indexed BAM file is walked one reference at a time with pysam so
+    that the unmapped reads at the end of the file are never decoded.
+    References are classified as spike-in or genomic once, by prefix,
+    into a lookup table indexed by reference id.
+    Unmapped mates placed with their pair, secondary and supplementary
+    records are skipped and only alignments with an NH tag of 1 are
+    counted. Paired-endedness is ignored.
+    '''
+
+    # P.submit() passes the file names as lists
+    bam_file = infiles[0] if isinstance(infiles, (list, tuple)) else infiles
+    spike_out, spliced_out = outfiles
+
+    bam = pysam.AlignmentFile(bam_file, "rb", threads=int(threads))
+
+    # reference class lookup table, indexed by tid: 1 = spike-in, 0 = genome
+    ref_class = np.array([1 if ref.startswith(spikein_pattern) else 0
+                          for ref in bam.references], dtype=np.int8)
+
+    counts = np.zeros(2, dtype=np.int64)
+    n_spliced = 0
+
+    for tid, contig in enumerate(bam.references):
+
+        n = 0
+
+        for read in bam.fetch(contig):
+
+            if (read.is_unmapped or read.is_secondary or
+                    read.is_supplementary):
+                continue
+
+            try:
+                if read.get_tag("NH") != 1:
+                    continue
+            except KeyError:
+                continue
+
+            n += 1
+
+            if is_spliced(read):
+                n_spliced += 1
+
+        counts[ref_class[tid]] += n
+
+    bam.close()
+
+    n_genome, n_spike = int(counts[0]), int(counts[1])
+
+    total = n_spike + n_genome
+
+    if total > 0:
+        fraction_spike = n_spike / total
+        fraction_spliced = n_spliced / total
+    else:
+        fraction_spike = np.nan
+        fraction_spliced = np.nan
+
+    with open(spike_out, "w") as out_file:
+        out_file.write("\t".join(["nreads_uniq_map_genome",
+                                  "nreads_uniq_map_spike",
+                                  "fraction_spike"]) + "\n")
+        out_file.write("%i\t%i\t%s\n" % (n_genome, n_spike, fraction_spike))
+
+    with open(spliced_out, "w") as out_file:
+        out_file.write("fraction_spliced\n")
+        out_file.write("%s\n" % fraction_spliced)
@@ -842,6 +842,20 @@ else:
     TX2GENE = PARAMS["salmon_tx2gene"]
 
 
+@transform(tabulateTranscriptInfoFromGTF,
+           regex("(.*)/.*"),
+           r"\1/gene_biotype.txt.gz")
+def geneBiotypes(infile, outfile):
+    '''
+    Preparation of a gene to biotype map for in-memory joins.
+    '''
+
+    gene_info = pd.read_csv(infile, sep="\t", header=0,
+                            usecols=["gene_id", "gene_biotype"])
+    gene_info = gene_info.drop_duplicates()
+    gene_info.to_csv(outfile, sep="\t", index=False, compression="gzip")
+
+
 @follows(mkdir("annotations.dir"), checkContigs)
 @files(QUANTITATION_GTF,
        "annotations.dir/quantitation.geneset.gtf.gz")
@@ -1089,13 +1103,28 @@ def salmonTPMs(infile, outfile):
     con = sqlite3.connect(PARAMS["database_file"])
     c = con.cursor()
 
+    ids = pd.Index(pd.read_sql('''select distinct Name from %(table)s
+                                  order by Name''' % locals(),
+                               con)["Name"])
+    sample_ids = pd.Index(pd.read_sql('''select distinct sample_id
+                                         from %(table)s
+                                         order by sample_id''' % locals(),
+                                      con)["sample_id"])
+
     sql = '''select sample_id, Name %(id_name)s, TPM tpm
              from %(table)s
           ''' % locals()
 
-    df = pd.read_sql(sql, con)
+    # assemble the wide table by direct assignment into a preallocated
+    # matrix rather than by pivoting (unstacking) the long table. The
+    # long table is streamed in chunks so that it is never held in full.
+    tpms = np.full((len(ids), len(sample_ids)), np.nan)
 
-    df = df.pivot(id_name, "sample_id", "tpm")
+    for chunk in pd.read_sql(sql, con, chunksize=500000):
+        tpms[ids.get_indexer(chunk[id_name]),
+             sample_ids.get_indexer(chunk["sample_id"])] = chunk["tpm"].to_numpy()
+
+    df = pd.DataFrame(tpms, index=ids, columns=sample_ids)
     df.to_csv(outfile, sep="\t", index=True, index_label=id_name)
 
 
@@ -1133,10 +1162,24 @@ def loadSalmonTPMs(infile, outfile):
 # "make loadCuffNormClassic"
 # "make loadCuffNormUQ"
 
+@transform(prepareQuantitationGenesetGTF,
+           suffix(".gtf.gz"),
+           ".gtf")
+def uncompressQuantitationGenesetGTF(infile, outfile):
+    '''
+    Prepare a single uncompressed copy of the quantitation geneset
+    to be shared by the cuffquant and cuffnorm jobs.
+    '''
+
+    statement = '''zcat %(infile)s > %(outfile)s'''
+
+    P.run(statement)
+
+
 @follows(mkdir("cuffquant.dir"))
 @transform(collectBAMs,
            regex(r".*/(.*).bam"),
-           add_inputs(prepareQuantitationGenesetGTF),
+           add_inputs(uncompressQuantitationGenesetGTF),
            r"cuffquant.dir/\1.log")
 def cuffQuant(infiles, outfile):
     '''
@@ -1158,9 +1201,7 @@ def cuffQuant(infiles, outfile):
 
     cufflinks_strand = CUFFLINKS_STRAND
 
-    statement = '''gtf=`mktemp -p %(cluster_tmpdir)s`;
-                   zcat %(geneset)s > $gtf;
-                   cuffquant
+    statement = '''cuffquant
                            --output-dir %(output_dir)s
                            --num-threads %(job_threads)s
                            --multi-read-correct
@@ -1170,15 +1211,14 @@ def cuffQuant(infiles, outfile):
                            --max-mle-iterations 10000
                            --verbose
                            --frag-bias-correct %(genome_multifasta)s
-                            $gtf %(bam_file)s >& %(outfile)s;
-                    rm $gtf;
+                           %(geneset)s %(bam_file)s >& %(outfile)s;
                 '''
 
     P.run(statement)
 
 
 @follows(mkdir("cuffnorm.classic.dir"), cuffQuant)
-@merge([prepareQuantitationGenesetGTF, cuffQuant],
+@merge([uncompressQuantitationGenesetGTF, cuffQuant],
        "cuffnorm.classic.dir/cuffnorm_classic.log")
 def cuffNormClassic(infiles, outfile):
     '''
@@ -1186,11 +1226,11 @@ def cuffNormClassic(infiles, outfile):
     for copy number estimation.
     '''
 
-    cxb_files = " ".join([f[:-len(".log")] + "/abundances.cxb"
-                          for f in infiles[1:]])
+    cxb_files = [f[:-len(".log")] + "/abundances.cxb"
+                 for f in infiles[1:]]
 
-    label_str = ",".join([os.path.basename(f)[:-len(".log")]
-                          for f in infiles[1:]])
+    labels = [os.path.basename(f)[:-len(".log")]
+              for f in infiles[1:]]
 
     # parse the infiles
     geneset = infiles[0]
@@ -1198,7 +1238,7 @@ def cuffNormClassic(infiles, outfile):
     # get the output directory and sample labels
     output_dir = os.path.dirname(outfile)
 
-    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, label_str,
+    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, labels,
                                  output_dir, outfile,
                                  library_type=CUFFLINKS_STRAND,
                                  normalisation="classic-fpkm", hits="total")
@@ -1221,7 +1261,7 @@ def loadCuffNormClassic(infile, outfile):
 
 
 @follows(mkdir("cuffnorm.uq.dir"), cuffQuant)
-@merge([prepareQuantitationGenesetGTF, cuffQuant],
+@merge([uncompressQuantitationGenesetGTF, cuffQuant],
        "cuffnorm.uq.dir/cuffnorm_uq.log")
 def cuffNormUQ(infiles, outfile):
     '''
@@ -1256,24 +1296,23 @@ def cuffNormUQ(infiles, outfile):
 
             cxb_groups.append(",".join(group_cxb_files))
 
-        cxb_files = " ".join(cxb_groups)
+        cxb_files = cxb_groups
 
     else:
 
         sample_ids = SAMPLES["sample_id"].values
 
-        cxb_files = " ".join([os.path.join(cxb_path, S, cxb_name)
-                              for S in sample_ids])
+        cxb_files = [os.path.join(cxb_path, S, cxb_name)
+                     for S in sample_ids]
 
         labels = sample_ids
 
-    # get the output directory and sample labels
+    # get the output directory
     output_dir = os.path.dirname(outfile)
-    label_str = ",".join(labels)
 
     standards = PARAMS["cufflinks_standards"]
 
-    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, label_str,
+    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, labels,
                                  output_dir, outfile,
                                  library_type=CUFFLINKS_STRAND,
                                  standards_file=standards,
@@ -1719,7 +1758,7 @@ def loadSpikeVsGenome(infiles, outfile):
 # ------------------------- No. genes detected ------------------------------ #
 
 @active_if(fastqMode)
-@follows(mkdir("qc.dir/"), loadSalmonTPMs, loadEnsemblAnnotations)
+@follows(mkdir("qc.dir/"), loadSalmonTPMs, geneBiotypes)
 @files("salmon.dir/salmon.genes.tpms.load",
        "qc.dir/number.genes.detected.salmon")
 def numberGenesDetectedSalmon(infile, outfile):
@@ -1729,25 +1768,29 @@ def numberGenesDetectedSalmon(infile, outfile):
 
     table = P.to_table(infile)
 
-    statement = '''select distinct s.*, i.gene_biotype
-                   from %(table)s s
-                   inner join transcript_info i
-                   on s.gene_id=i.gene_id
-                ''' % locals()
+    statement = '''select * from %(table)s''' % locals()
 
     df = DB.fetch_DataFrame(statement, DATABASE)
 
-    melted_df = pd.melt(df, id_vars=["gene_id", "gene_biotype"])
+    # join the gene biotypes in memory rather than in sqlite
+    gene_biotypes = pd.read_csv("annotations.dir/gene_biotype.txt.gz",
+                                sep="\t", dtype={"gene_biotype": "category"})
 
-    grouped_df = melted_df.groupby(["gene_biotype", "variable"])
+    df = df.merge(gene_biotypes, on="gene_id", how="inner")
 
-    agg_df = grouped_df.agg({"value": lambda x:
-                             np.sum([1 for y in x if y > 0])})
-    agg_df.reset_index(inplace=True)
+    biotypes = df.pop("gene_biotype").to_numpy()
+    df.pop("gene_id")
 
-    count_df = pd.pivot_table(agg_df, index="variable",
-                              values="value", columns="gene_biotype")
-    count_df["total"] = count_df.apply(np.sum, 1)
+    # count the genes detected per sample on the wide (genes x samples)
+    # matrix rather than on a melted long format table
+    detected = df.to_numpy() > 0
+
+    count_df = pd.DataFrame(
+        {biotype: detected[biotypes == biotype].sum(axis=0)
+         for biotype in sorted(pd.unique(biotypes[pd.notnull(biotypes)]))},
+        index=df.columns)
+
+    count_df["total"] = count_df.sum(axis=1)
     count_df["sample_id"] = count_df.index
 
     count_df.to_csv(outfile, index=False, sep="\t")
@@ -173,6 +173,7 @@ Code
 from ruffus import *
 
 import sys
+import re
 import shutil
 import os
 from pathlib import Path
@@ -241,74 +242,48 @@ if len(SAMPLE_FILES) == 0:
     raise ValueError("No input files detected")
 
 SAMPLE_IDS = set([os.path.basename(SF).split(".")[0] for SF in SAMPLE_FILES])
-NAME_FIELD_TITLES = PARAMS["name_field_titles"].split(",")
+NAME_FIELD_TITLES = [x.strip() for x in
+                     PARAMS["name_field_titles"].split(",")]
+
+# name fields are separated with underscores in the file names
+NAME_FIELD_SEPARATOR = "_"
 
 # Check field names
 if any([x in NAME_FIELD_TITLES for x in ("sample_id")]):
     raise ValueError('"sample_id" is reserved and cannot'
                      'be used as a name field title')
 
+# Split the sample ids into their name fields
+sample_ids = pd.Series(sorted(SAMPLE_IDS), name="sample_id")
+
 # Sanity check file names
-for sample_id in SAMPLE_IDS:
-    if len(sample_id.split("_")) != len(NAME_FIELD_TITLES):
-        raise ValueError("%(sample_id)s does not have the expected"
-                         " number of name fields (%(NAME_FIELD_TITLES)s)."
-                         " Note that name fields must be separated with"
-                         " underscores" % locals())
+n_fields = sample_ids.str.count(NAME_FIELD_SEPARATOR) + 1
+bad_ids = sample_ids[n_fields != len(NAME_FIELD_TITLES)]
+
+if len(bad_ids) > 0:
+    sample_id = bad_ids.iloc[0]
+    raise ValueError("%(sample_id)s does not have the expected"
+                     " number of name fields (%(NAME_FIELD_TITLES)s)."
+                     " Note that name fields must be separated with"
+                     " underscores" % locals())
 
 # Prepare sample table
-SAMPLES = pd.DataFrame([dict(list(zip(["sample_id"] + NAME_FIELD_TITLES,
-                                      [SAMPLE_ID] + SAMPLE_ID.split("_"))))
-                        for SAMPLE_ID in SAMPLE_IDS])
+name_fields = sample_ids.str.split(NAME_FIELD_SEPARATOR, expand=True)
+name_fields.columns = NAME_FIELD_TITLES
+
+SAMPLES = pd.concat([sample_ids, name_fields], axis=1)
 
 
 # ########################################################################### #
 # ######## Define endedness, strandedness and spike-in parameters ########### #
 # ########################################################################### #
 
-# Determine endedness
-if str(PARAMS["paired"]).lower() in ("1", "true", "yes"):
-    PAIRED = True
-elif str(PARAMS["paired"]).lower() in ("0", "false", "no"):
-    PAIRED = False
-else:
-    raise ValueError("Endedness not recognised")
-
-# set options based on strandedness
-STRAND = str(PARAMS["strandedness"]).lower()
-if STRAND not in ("none", "forward", "reverse"):
-    raise ValueError("Strand not recognised")
-
-if STRAND == "none":
-    CUFFLINKS_STRAND = "fr-unstranded"
-    FEATURECOUNTS_STRAND = "0"
-    PICARD_STRAND = "NONE"
-    SALMON_STRAND = "U"
-
-elif STRAND == "forward":
-    if PAIRED:
-        HISAT_STRAND = "FR"
-    else:
-        HISAT_STRAND = "F"
-    SALMON_STRAND = "SF"
-    CUFFLINKS_STRAND = "fr-secondstrand"
-    FEATURECOUNTS_STRAND = "1"
-    PICARD_STRAND = "FIRST_READ_TRANSCRIPTION_STRAND"
-
-elif STRAND == "reverse":
-    if PAIRED:
-        HISAT_STRAND = "RF"
-    else:
-        HISAT_STRAND = "R"
-    SALMON_STRAND = "SR"
-    CUFFLINKS_STRAND = "fr-firststrand"
-    FEATURECOUNTS_STRAND = "2"
-    PICARD_STRAND = "SECOND_READ_TRANSCRIPTION_STRAND"
+# The endedness and strand derived tool options are resolved once here
+# and read from the frozen LIBRARY object by the tasks
+LIBRARY = PipelineScRnaseq.libraryParameters(PARAMS["paired"],
+                                             PARAMS["strandedness"])
 
-if PAIRED:
-    SALMON_LIBTYPE = "I" + SALMON_STRAND
-else:
-    SALMON_LIBTYPE = SALMON_STRAND
+PAIRED = LIBRARY.paired
 
 SPIKES = PARAMS["spikein_present"]
 
@@ -530,12 +505,10 @@ def generateSalmonIndex(infile, outfile):
     index_folder = SALMON_INDEX
     job_memory = PARAMS["salmon_index_memory"]
     statement = '''fasta_out=`mktemp -p %(cluster_tmpdir)s`;
-            gtf=`mktemp -p %(cluster_tmpdir)s`;
-            zcat %(infile)s > $gtf ;
              gffread
             -w $fasta_out
             -g %(genome_fasta)s
-            $gtf ;
+            <(zcat %(infile)s) ;
             salmon index
             -t $fasta_out
             -i %(index_folder)s
@@ -556,11 +529,7 @@ if PAIRED:
 else:
         fastq_pattern = "*.fastq.gz"
 
-if STRAND != "none":
-    HISAT_STRAND_PARAM = "--rna-strandness %s" % HISAT_STRAND
-else:
-    HISAT_STRAND_PARAM = ""
-
+HISAT_INDEX = PARAMS["hisat_index"]
 HISAT_THREADS = PARAMS["hisat_threads"]
 HISAT_MEMORY = str(int(PARAMS["hisat_total_mb_memory"]) //
                    int(HISAT_THREADS)) + "M"
@@ -569,7 +538,7 @@ HISAT_MEMORY = str(int(PARAMS["hisat_total_mb_memory"]) //
 @follows(mkdir("hisat.dir/first.pass.dir"), checkContigs)
 @transform(glob.glob(os.path.join(PARAMS["input_dir"], fastq_pattern)),
            regex(r".*/(.*).fastq.*.gz"),
-           r"hisat.dir/first.pass.dir/\1.novel.splice.sites.txt.gz")
+           r"hisat.dir/first.pass.dir/\1.novel.splice.sites.txt.zst")
 def hisatFirstPass(infile, outfile):
     '''
     Run a first hisat pass to identify novel splice sites.
@@ -583,9 +552,9 @@ def hisatFirstPass(infile, outfile):
     else:
         reads_one = [reads_one]
 
-    index = PARAMS["hisat_index"]
+    index = HISAT_INDEX
     log = outfile + ".log"
-    out_name = outfile[:-len(".gz")]
+    out_name = outfile[:-len(".zst")]
 
     # queue options
     to_cluster = True  # this is the default
@@ -599,7 +568,7 @@ def hisatFirstPass(infile, outfile):
     else:
         fastq_input = "-U " + ",".join(reads_one)
 
-    hisat_strand_param = HISAT_STRAND_PARAM
+    hisat_strand_param = LIBRARY.hisat_strand_param
 
     statement = '''%(hisat_executable)s
                         -x %(index)s
@@ -610,7 +579,10 @@ def hisatFirstPass(infile, outfile):
                         %(hisat_options)s
                         -S /dev/null
                         &> %(log)s;
-                    gzip %(out_name)s
+                    LC_ALL=C sort -u
+                        -T %(cluster_tmpdir)s
+                        %(out_name)s -o %(out_name)s;
+                    zstd -q --rm -T%(job_threads)s %(out_name)s
                 '''
 
     P.run(statement)
@@ -623,11 +595,17 @@ def novelHisatSpliceSites(infiles, outfile):
     Collect the novel splice sites into a single file.
     '''
 
-    junction_files = " ".join(infiles)
+    job_threads = HISAT_THREADS
+
+    # the per-sample files are already sorted (see hisatFirstPass)
+    # so a linear merge is sufficient
+    junction_files = " ".join(["<(zstdcat %s)" % x for x in infiles])
 
-    statement = '''zcat %(junction_files)s
-                   | sort -k1,1 -T %(cluster_tmpdir)s
-                   | uniq
+    statement = '''LC_ALL=C sort -u --merge
+                       --parallel=%(job_threads)s
+                       -S 2G
+                       -T %(cluster_tmpdir)s
+                       %(junction_files)s
                    > %(outfile)s
                 '''
 
@@ -650,7 +628,7 @@ def hisatAlignments(infiles, outfile):
     else:
         reads_one = [reads_one]
 
-    index = PARAMS["hisat_index"]
+    index = HISAT_INDEX
     log = outfile + ".log"
 
     to_cluster = True
@@ -664,7 +642,7 @@ def hisatAlignments(infiles, outfile):
     else:
         fastq_input = "-U " + ",".join(reads_one)
 
-    hisat_strand_param = HISAT_STRAND_PARAM
+    hisat_strand_param = LIBRARY.hisat_strand_param
 
     statement = '''sort_sam=`mktemp -p %(cluster_tmpdir)s`;
                    %(hisat_executable)s
@@ -675,9 +653,14 @@ def hisatAlignments(infiles, outfile):
                       %(hisat_strand_param)s
                       %(hisat_options)s
                    2> %(log)s
-                   | samtools view - -bS
-                   | samtools sort - -T $sort_sam -o %(outfile)s >>%(log)s;
-                   samtools index %(outfile)s;
+                   | samtools sort
+                      -@ %(job_threads)s
+                      -m 1G
+                      -T $sort_sam
+                      -O bam
+                      --write-index
+                      -o %(outfile)s##idx##%(outfile)s.bai
+                      - >>%(log)s;
                    rm $sort_sam;
                  '''
 
@@ -708,6 +691,28 @@ else:
     raise ValueError('Input type must be either "fastq" or "bam"')
 
 
+@active_if(not fastqMode)
+@transform(collectBAMs,
+           suffix(".bam"),
+           ".bam.csi")
+def indexBAMs(infile, outfile):
+    '''
+    Index the input BAM files (the BAM files produced by hisatAlignments
+    are indexed as they are sorted). The indexes are required by the
+    post-mapping QC tasks which iterate over the BAM files by region.
+    '''
+
+    job_threads = 4
+
+    statement = '''samtools index
+                       -@ %(job_threads)s
+                       -c %(infile)s
+                       %(outfile)s
+                '''
+
+    P.run(statement)
+
+
 # ########################################################################### #
 # ################ (2) Quantitation of gene expression #################### #
 # ########################################################################### #
@@ -842,6 +847,20 @@ else:
     TX2GENE = PARAMS["salmon_tx2gene"]
 
 
+@transform(tabulateTranscriptInfoFromGTF,
+           regex("(.*)/.*"),
+           r"\1/gene_biotype.txt.gz")
+def geneBiotypes(infile, outfile):
+    '''
+    Preparation of a gene to biotype map for in-memory joins.
+    '''
+
+    gene_info = pd.read_csv(infile, sep="\t", header=0,
+                            usecols=["gene_id", "gene_biotype"])
+    gene_info = gene_info.drop_duplicates()
+    gene_info.to_csv(outfile, sep="\t", index=False, compression="gzip")
+
+
 @follows(mkdir("annotations.dir"), checkContigs)
 @files(QUANTITATION_GTF,
        "annotations.dir/quantitation.geneset.gtf.gz")
@@ -882,23 +901,28 @@ def annotations():
 
 # ----------------------------- Read Counting ------------------------------- #
 
-@follows(mkdir("featureCounts.dir"))
-@transform(collectBAMs,
-           regex(r".*/(.*).bam"),
-           add_inputs(prepareQuantitationGenesetGTF),
-           r"featureCounts.dir/\1.counts.gz")
+@follows(mkdir("featureCounts.dir"), prepareQuantitationGenesetGTF)
+@merge(collectBAMs,
+       "featureCounts.dir/featurecounts.counts.gz")
 def featureCounts(infiles, outfile):
     '''
     Run featureCounts.
+
+    All of the BAM files are counted in a single featureCounts
+    invocation so that the geneset is only parsed once. The count
+    matrix is then written out in long (track, gene_id, counts) format.
+
     Note that we first need to change directory to a scratch location because
     the current dir is hard coded as the temp dir!!
     '''
 
-    bamfile, geneset = [os.path.abspath(x) for x in infiles]
-    outfile_name = os.path.abspath(outfile)
+    bamfiles = " ".join([os.path.abspath(x) for x in infiles])
+    geneset = os.path.abspath("annotations.dir/quantitation.geneset.gtf.gz")
+    counts_matrix = os.path.abspath(outfile[:-len(".counts.gz")] +
+                                    ".matrix.txt")
 
     # set featureCounts options
-    featurecounts_strand = FEATURECOUNTS_STRAND
+    featurecounts_strand = LIBRARY.featurecounts_strand
 
     if PAIRED:
         paired_options = "-p"
@@ -913,60 +937,65 @@ def featureCounts(infiles, outfile):
     job_threads = PARAMS["featurecounts_threads"]
 
     statement = '''cd %(cluster_tmpdir)s;
-                   gtf=`mktemp -p %(cluster_tmpdir)s`;
-                   counts=`mktemp -p %(cluster_tmpdir)s`;
-                   zcat %(geneset)s > $gtf;
                    featureCounts
-                        -a $gtf
-                        -o $counts
+                        -a %(geneset)s
+                        -o %(counts_matrix)s
                         -s %(featurecounts_strand)s
                         -T %(featurecounts_threads)s
                         %(featurecounts_options)s
                         %(paired_options)s
-                        %(bamfile)s;
-                        cut -f1,7 $counts
-                        | grep -v "#" | grep -v "Geneid"
-                        | gzip -c > %(outfile_name)s;
-                        rm $gtf;
-                        rm $counts;
+                        %(bamfiles)s
                  '''
 
     P.run(statement)
 
+    # columns are: Geneid, Chr, Start, End, Strand, Length, <bam files>
+    df = pd.read_csv(counts_matrix, sep="\t", comment="#")
+    df = df.drop(columns=["Chr", "Start", "End", "Strand", "Length"])
+    df.columns = ["gene_id"] + [os.path.basename(x)[:-len(".bam")]
+                                for x in df.columns[1:]]
+
+    df = pd.melt(df, id_vars="gene_id", var_name="track",
+                 value_name="counts")
+
+    df[["track", "gene_id", "counts"]].to_csv(outfile, sep="\t",
+                                              index=False,
+                                              compression="gzip")
 
-@merge(featureCounts,
+
+@files(featureCounts,
        "featureCounts.dir/featurecounts.load")
-def loadFeatureCounts(infiles, outfile):
+def loadFeatureCounts(infile, outfile):
     '''
-    Combine and load count data in the project database.
+    Load the count data in the project database.
     '''
 
-    P.concatenate_and_load(infiles, outfile,
-                           regex_filename=".*/(.*).counts.gz",
-                           has_titles=False,
-                           cat="track",
-                           header="track,gene_id,counts",
-                           options='-i "gene_id"',
-                           job_memory=PARAMS["sql_himem"])
+    P.load(infile, outfile,
+           options='-i "gene_id" -i "track"',
+           job_memory=PARAMS["sql_himem"])
 
 
-@files(loadFeatureCounts,
+@files(featureCounts,
        "featureCounts.dir/featurecounts_counts.txt")
 def featurecountsGeneCounts(infile, outfile):
     '''
     Prepare a gene-by-sample table of featureCounts counts.
+
+    The table is taken directly from the featureCounts matrix (which
+    already has one column per sample) rather than by pivoting the
+    long format table back out of the database.
     '''
 
-    table = P.to_table(infile)
-    con = sqlite3.connect(PARAMS["database_file"])
-    c = con.cursor()
+    counts_matrix = infile[:-len(".counts.gz")] + ".matrix.txt"
 
-    sql = '''select track, gene_id, counts
-             from %(table)s t
-          ''' % locals()
+    # columns are: Geneid, Chr, Start, End, Strand, Length, <bam files>
+    df = pd.read_csv(counts_matrix, sep="\t", comment="#", index_col=0)
+    df = df.iloc[:, 5:].astype(np.int32)
+
+    df.columns = [os.path.basename(x)[:-len(".bam")] for x in df.columns]
+    df.index.name = "gene_id"
 
-    df = pd.read_sql(sql, con)
-    df = df.pivot("gene_id", "track", "counts")
+    df = df.sort_index().sort_index(axis=1)
     df.to_csv(outfile, sep="\t", index=True, index_label="gene_id")
 
 
@@ -1017,7 +1046,7 @@ def salmon(infiles, outfile):
     else:
         salmon_options = ''
 
-    salmon_libtype = SALMON_LIBTYPE
+    salmon_libtype = LIBRARY.salmon_libtype
     salmon_params = PARAMS["salmon_params"]
     job_threads = PARAMS["salmon_threads"]
 
@@ -1086,16 +1115,30 @@ def salmonTPMs(infile, outfile):
     else:
         raise ValueError("Unexpected Salmon table name")
 
-    con = sqlite3.connect(PARAMS["database_file"])
-    c = con.cursor()
+    con = PipelineScRnaseq.connect(PARAMS["database_file"])
+
+    ids = pd.Index(pd.read_sql('''select distinct Name from %(table)s
+                                  order by Name''' % locals(),
+                               con)["Name"])
+    sample_ids = pd.Index(pd.read_sql('''select distinct sample_id
+                                         from %(table)s
+                                         order by sample_id''' % locals(),
+                                      con)["sample_id"])
 
     sql = '''select sample_id, Name %(id_name)s, TPM tpm
              from %(table)s
           ''' % locals()
 
-    df = pd.read_sql(sql, con)
+    # assemble the wide table by direct assignment into a preallocated
+    # matrix rather than by pivoting (unstacking) the long table. The
+    # long table is streamed in chunks so that it is never held in full.
+    tpms = np.full((len(ids), len(sample_ids)), np.nan)
 
-    df = df.pivot(id_name, "sample_id", "tpm")
+    for chunk in pd.read_sql(sql, con, chunksize=500000):
+        tpms[ids.get_indexer(chunk[id_name]),
+             sample_ids.get_indexer(chunk["sample_id"])] = chunk["tpm"].to_numpy()
+
+    df = pd.DataFrame(tpms, index=ids, columns=sample_ids)
     df.to_csv(outfile, sep="\t", index=True, index_label=id_name)
 
 
@@ -1133,10 +1176,43 @@ def loadSalmonTPMs(infile, outfile):
 # "make loadCuffNormClassic"
 # "make loadCuffNormUQ"
 
-@follows(mkdir("cuffquant.dir"))
+GENOME_MULTIFASTA = os.path.join(PARAMS["annotations_genome_dir"],
+                                 PARAMS["annotations_genome"] + ".fasta")
+
+CUFFQUANT_THREADS = PARAMS["cufflinks_cuffquant_threads"]
+
+
+@files(GENOME_MULTIFASTA,
+       GENOME_MULTIFASTA + ".fai")
+def indexGenomeFasta(infile, outfile):
+    '''
+    Index the genome multifasta once, ahead of the cuffquant jobs
+    that use it for fragment bias correction.
+    '''
+
+    statement = '''samtools faidx %(infile)s'''
+
+    P.run(statement)
+
+
+@transform(prepareQuantitationGenesetGTF,
+           suffix(".gtf.gz"),
+           ".gtf")
+def uncompressQuantitationGenesetGTF(infile, outfile):
+    '''
+    Prepare a single uncompressed copy of the quantitation geneset
+    to be shared by the cuffquant and cuffnorm jobs.
+    '''
+
+    statement = '''zcat %(infile)s > %(outfile)s'''
+
+    P.run(statement)
+
+
+@follows(mkdir("cuffquant.dir"), indexGenomeFasta)
 @transform(collectBAMs,
            regex(r".*/(.*).bam"),
-           add_inputs(prepareQuantitationGenesetGTF),
+           add_inputs(uncompressQuantitationGenesetGTF),
            r"cuffquant.dir/\1.log")
 def cuffQuant(infiles, outfile):
     '''
@@ -1149,18 +1225,15 @@ def cuffQuant(infiles, outfile):
     # a unique output directory for each sample is required
     output_dir = outfile[:-len(".log")]
 
-    job_threads = PARAMS["cufflinks_cuffquant_threads"]  # 4
+    job_threads = CUFFQUANT_THREADS
 
     to_cluster = True
 
-    genome_multifasta = os.path.join(PARAMS["annotations_genome_dir"],
-                                     PARAMS["annotations_genome"]+".fasta")
+    genome_multifasta = GENOME_MULTIFASTA
 
-    cufflinks_strand = CUFFLINKS_STRAND
+    cufflinks_strand = LIBRARY.cufflinks_strand
 
-    statement = '''gtf=`mktemp -p %(cluster_tmpdir)s`;
-                   zcat %(geneset)s > $gtf;
-                   cuffquant
+    statement = '''cuffquant
                            --output-dir %(output_dir)s
                            --num-threads %(job_threads)s
                            --multi-read-correct
@@ -1170,15 +1243,14 @@ def cuffQuant(infiles, outfile):
                            --max-mle-iterations 10000
                            --verbose
                            --frag-bias-correct %(genome_multifasta)s
-                            $gtf %(bam_file)s >& %(outfile)s;
-                    rm $gtf;
+                           %(geneset)s %(bam_file)s >& %(outfile)s;
                 '''
 
     P.run(statement)
 
 
 @follows(mkdir("cuffnorm.classic.dir"), cuffQuant)
-@merge([prepareQuantitationGenesetGTF, cuffQuant],
+@merge([uncompressQuantitationGenesetGTF, cuffQuant],
        "cuffnorm.classic.dir/cuffnorm_classic.log")
 def cuffNormClassic(infiles, outfile):
     '''
@@ -1186,11 +1258,11 @@ def cuffNormClassic(infiles, outfile):
     for copy number estimation.
     '''
 
-    cxb_files = " ".join([f[:-len(".log")] + "/abundances.cxb"
-                          for f in infiles[1:]])
+    cxb_files = [f[:-len(".log")] + "/abundances.cxb"
+                 for f in infiles[1:]]
 
-    label_str = ",".join([os.path.basename(f)[:-len(".log")]
-                          for f in infiles[1:]])
+    labels = [os.path.basename(f)[:-len(".log")]
+              for f in infiles[1:]]
 
     # parse the infiles
     geneset = infiles[0]
@@ -1198,9 +1270,9 @@ def cuffNormClassic(infiles, outfile):
     # get the output directory and sample labels
     output_dir = os.path.dirname(outfile)
 
-    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, label_str,
+    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, labels,
                                  output_dir, outfile,
-                                 library_type=CUFFLINKS_STRAND,
+                                 library_type=LIBRARY.cufflinks_strand,
                                  normalisation="classic-fpkm", hits="total")
 
 
@@ -1221,7 +1293,7 @@ def loadCuffNormClassic(infile, outfile):
 
 
 @follows(mkdir("cuffnorm.uq.dir"), cuffQuant)
-@merge([prepareQuantitationGenesetGTF, cuffQuant],
+@merge([uncompressQuantitationGenesetGTF, cuffQuant],
        "cuffnorm.uq.dir/cuffnorm_uq.log")
 def cuffNormUQ(infiles, outfile):
     '''
@@ -1248,7 +1320,7 @@ def cuffNormUQ(infiles, outfile):
         cxb_groups = []
         for group, indices in agg.groups.items():
 
-            labels.append("_".join(group))
+            labels.append(NAME_FIELD_SEPARATOR.join(group))
 
             group_cxb_files = [os.path.join(cxb_path, S, cxb_name)
                                for S in
@@ -1256,26 +1328,25 @@ def cuffNormUQ(infiles, outfile):
 
             cxb_groups.append(",".join(group_cxb_files))
 
-        cxb_files = " ".join(cxb_groups)
+        cxb_files = cxb_groups
 
     else:
 
         sample_ids = SAMPLES["sample_id"].values
 
-        cxb_files = " ".join([os.path.join(cxb_path, S, cxb_name)
-                              for S in sample_ids])
+        cxb_files = [os.path.join(cxb_path, S, cxb_name)
+                     for S in sample_ids]
 
         labels = sample_ids
 
-    # get the output directory and sample labels
+    # get the output directory
     output_dir = os.path.dirname(outfile)
-    label_str = ",".join(labels)
 
     standards = PARAMS["cufflinks_standards"]
 
-    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, label_str,
+    PipelineScRnaseq.runCuffNorm(geneset, cxb_files, labels,
                                  output_dir, outfile,
-                                 library_type=CUFFLINKS_STRAND,
+                                 library_type=LIBRARY.cufflinks_strand,
                                  standards_file=standards,
                                  normalisation="quartile", hits="compatible")
 
@@ -1356,91 +1427,179 @@ def quantitation():
 PICARD_THREADS = PARAMS["picard_threads"]
 PICARD_MEMORY = str(int(PARAMS["picard_total_mb_memory"]) //
                     int(PICARD_THREADS)) + "M"
+PICARD_VALIDATION_STRINGENCY = PARAMS["picard_validation_stringency"]
+PICARD_LIBRARY_COMPLEXITY_OPTIONS = (
+    PARAMS["picard_estimatelibrarycomplexity_options"] or "")
+
+
+# ------------------- Picard: CollectMultipleMetrics ------------------------ #
+
+def picardExtraArguments(program, options):
+    '''
+    Format module specific Picard options for CollectMultipleMetrics.
+    '''
 
+    if not options:
+        return ""
 
-# ------------------- Picard: CollectRnaSeqMetrics -------------------------- #
+    return " ".join(["EXTRA_ARGUMENT=%s::%s" % (program, x)
+                     for x in options.split()])
 
-@follows(mkdir("qc.dir/rnaseq.metrics.dir/"))
+
+PICARD_RNASEQ_OPTIONS = picardExtraArguments(
+    "RnaSeqMetrics",
+    PARAMS["picard_collectrnaseqmetrics_options"])
+
+PICARD_ALIGNMENT_OPTIONS = picardExtraArguments(
+    "CollectAlignmentSummaryMetrics",
+    PARAMS["picard_alignmentsummarymetrics_options"])
+
+PICARD_INSERT_SIZE_OPTIONS = picardExtraArguments(
+    "CollectInsertSizeMetrics",
+    PARAMS["picard_insertsizemetric_options"])
+
+
+@follows(indexBAMs,
+         mkdir("qc.dir/rnaseq.metrics.dir/"),
+         mkdir("qc.dir/alignment.summary.metrics.dir/"),
+         mkdir("qc.dir/insert.size.metrics.dir/"))
 @transform(collectBAMs,
            regex(r".*/(.*).bam"),
            add_inputs(prepareEnsemblGenesetFlat),
-           r"qc.dir/rnaseq.metrics.dir/\1.rnaseq.metrics")
-def collectRnaSeqMetrics(infiles, outfile):
+           [r"qc.dir/rnaseq.metrics.dir/\1.rnaseq.metrics",
+            (r"qc.dir/alignment.summary.metrics.dir"
+             r"/\1.alignment.summary.metrics"),
+            (r"qc.dir/insert.size.metrics.dir"
+             r"/\1.insert.size.metrics.summary"),
+            (r"qc.dir/insert.size.metrics.dir"
+             r"/\1.insert.size.metrics.histogram")])
+def collectMultipleMetrics(infiles, outfiles):
     '''
-    Run Picard CollectRnaSeqMetrics on the bam files.
+    Run Picard CollectMultipleMetrics on the bam files.
+
+    The RnaSeqMetrics, AlignmentSummaryMetrics and (for paired-end
+    data) InsertSizeMetrics modules are run in a single JVM from a
+    single pass over each BAM file.
     '''
 
     bam_file, geneset_flat = infiles
 
-    if PARAMS["picard_collectrnaseqmetrics_options"]:
-        picard_options = PARAMS["picard_collectrnaseqmetrics_options"]
-    else:
-        picard_options = ""
+    (rnaseq_metrics, alignment_summary_metrics,
+     picard_summary, picard_histogram) = outfiles
 
-    validation_stringency = PARAMS["picard_validation_stringency"]
+    validation_stringency = PICARD_VALIDATION_STRINGENCY
 
     job_threads = PICARD_THREADS
     job_memory = PICARD_MEMORY
 
-    coverage_out = outfile[:-len(".metrics")] + ".cov.hist"
-    chart_out = outfile[:-len(".metrics")] + ".cov.pdf"
+    reference_sequence = GENOME_MULTIFASTA
 
-    picard_strand = PICARD_STRAND
+    coverage_out = rnaseq_metrics[:-len(".metrics")] + ".cov.hist"
+    chart_out = rnaseq_metrics[:-len(".metrics")] + ".cov.pdf"
+    picard_histogram_pdf = picard_histogram + ".pdf"
 
-    statement = '''picard_out=`mktemp -p %(cluster_tmpdir)s`;
-                   CollectRnaSeqMetrics
+    picard_strand = LIBRARY.picard_strand
+
+    rnaseq_options = PICARD_RNASEQ_OPTIONS
+    alignment_options = PICARD_ALIGNMENT_OPTIONS
+
+    if PAIRED:
+        insert_size_program = "PROGRAM=CollectInsertSizeMetrics"
+        insert_size_options = PICARD_INSERT_SIZE_OPTIONS
+    else:
+        insert_size_program = ""
+        insert_size_options = ""
+
+    # the raw Picard output is written next to the results and is parsed
+    # in Python once the job has finished
+    picard_out = rnaseq_metrics[:-len(".rnaseq.metrics")] + ".picard"
+
+    statement = '''CollectMultipleMetrics
                    I=%(bam_file)s
-                   REF_FLAT=%(geneset_flat)s
-                   O=$picard_out
-                   CHART=%(chart_out)s
-                   STRAND_SPECIFICITY=%(picard_strand)s
+                   O=%(picard_out)s
+                   REFERENCE_SEQUENCE=%(reference_sequence)s
                    VALIDATION_STRINGENCY=%(validation_stringency)s
-                   %(picard_options)s;
-                   grep . $picard_out | grep -v "#" | head -n2
-                   > %(outfile)s;
-                   grep . $picard_out
-                   | grep -A 102 "## HISTOGRAM"
-                   | grep -v "##"
-                   > %(coverage_out)s;
-                   rm $picard_out;
+                   PROGRAM=null
+                   PROGRAM=RnaSeqMetrics
+                   PROGRAM=CollectAlignmentSummaryMetrics
+                   %(insert_size_program)s
+                   EXTRA_ARGUMENT=RnaSeqMetrics::REF_FLAT=%(geneset_flat)s
+                   EXTRA_ARGUMENT=RnaSeqMetrics::CHART_OUTPUT=%(chart_out)s
+                   EXTRA_ARGUMENT=RnaSeqMetrics::STRAND_SPECIFICITY=%(picard_strand)s
+                   %(rnaseq_options)s
+                   %(alignment_options)s
+                   %(insert_size_options)s
                 '''
 
     P.run(statement)
 
+    PipelineScRnaseq.splitPicardOutput(picard_out + ".rna_metrics",
+                                       rnaseq_metrics,
+                                       coverage_out)
+
+    PipelineScRnaseq.splitPicardOutput(picard_out +
+                                       ".alignment_summary_metrics",
+                                       alignment_summary_metrics,
+                                       summary_lines=None)
+
+    if PAIRED:
+        PipelineScRnaseq.splitPicardOutput(picard_out +
+                                           ".insert_size_metrics",
+                                           picard_summary,
+                                           picard_histogram)
+
+        shutil.move(picard_out + ".insert_size_histogram.pdf",
+                    picard_histogram_pdf)
 
-@merge(collectRnaSeqMetrics,
+    else:
+        for fn in (picard_summary, picard_histogram):
+            with open(fn, "w") as out_file:
+                out_file.write("Not compatible with SE data\n")
+
+    for raw in glob.glob(picard_out + ".*"):
+        os.remove(raw)
+
+
+@merge(collectMultipleMetrics,
        "qc.dir/qc_rnaseq_metrics.load")
 def loadCollectRnaSeqMetrics(infiles, outfile):
     '''
     Load the metrics to the db.
     '''
 
-    P.concatenate_and_load(infiles, outfile,
-                           regex_filename=".*/.*/(.*).rnaseq.metrics",
-                           cat="sample_id",
-                           options='-i "sample_id"')
+    infiles = [x[0] for x in infiles]
+
+    PipelineScRnaseq.bulkLoad(infiles, outfile,
+                              PARAMS["database_file"],
+                              regex_filename=".*/.*/(.*).rnaseq.metrics",
+                              cat="sample_id",
+                              index_cols=["sample_id"])
 
 
 # --------------------- Three prime bias analysis --------------------------- #
 
-@transform(collectRnaSeqMetrics,
+@transform(collectMultipleMetrics,
            suffix(".rnaseq.metrics"),
            ".three.prime.bias")
-def threePrimeBias(infile, outfile):
+def threePrimeBias(infiles, outfile):
     '''
     Compute a sensible three prime bias metric
     from the picard coverage histogram.
     '''
 
-    coverage_histogram = infile[:-len(".metrics")] + ".cov.hist"
+    rnaseq_metrics = infiles[0]
+    coverage_histogram = rnaseq_metrics[:-len(".metrics")] + ".cov.hist"
 
-    df = pd.read_csv(coverage_histogram, sep="\t")
+    # the histogram is small (~101 rows) so a plain ndarray is used
+    # columns: normalized_position, All_Reads.normalized_coverage
+    hist = np.loadtxt(coverage_histogram, skiprows=1, usecols=(0, 1),
+                      dtype=np.float32, ndmin=2)
 
-    x = "normalized_position"
-    cov = "All_Reads.normalized_coverage"
+    tp_sum, tp_n, body_sum, body_n = PipelineScRnaseq.threePrimeBiasSums(
+        hist[:, 0], hist[:, 1])
 
-    three_prime_coverage = np.mean(df[cov][(df[x] > 70) & (df[x] < 90)])
-    transcript_body_coverage = np.mean(df[cov][(df[x] > 20) & (df[x] < 90)])
+    three_prime_coverage = tp_sum / tp_n if tp_n > 0 else np.nan
+    transcript_body_coverage = body_sum / body_n if body_n > 0 else np.nan
     bias = three_prime_coverage / transcript_body_coverage
 
     with open(outfile, "w") as out_file:
@@ -1465,7 +1624,7 @@ def loadThreePrimeBias(infiles, outfile):
 
 
 @active_if(PAIRED)
-@follows(mkdir("qc.dir/library.complexity.dir/"))
+@follows(indexBAMs, mkdir("qc.dir/library.complexity.dir/"))
 @transform(collectBAMs,
            regex(r".*/(.*).bam"),
            r"qc.dir/library.complexity.dir/\1.library.complexity")
@@ -1474,29 +1633,27 @@ def estimateLibraryComplexity(infile, outfile):
     Run Picard EstimateLibraryComplexity on the BAM files.
     '''
 
-    if PARAMS["picard_estimatelibrarycomplexity_options"]:
-        picard_options = PARAMS["picard_estimatelibrarycomplexity_options"]
-    else:
-        picard_options = ""
+    picard_options = PICARD_LIBRARY_COMPLEXITY_OPTIONS
 
-    validation_stringency = PARAMS["picard_validation_stringency"]
+    validation_stringency = PICARD_VALIDATION_STRINGENCY
 
     job_threads = PICARD_THREADS
     job_memory = PICARD_MEMORY
 
-    statement = '''picard_out=`mktemp -p %(cluster_tmpdir)s`;
-                   EstimateLibraryComplexity
+    picard_out = outfile + ".picard"
+
+    statement = '''EstimateLibraryComplexity
                    I=%(infile)s
-                   O=$picard_out
+                   O=%(picard_out)s
                    VALIDATION_STRINGENCY=%(validation_stringency)s
-                   %(picard_options)s;
-                   grep . $picard_out | grep -v "#" | head -n2
-                   > %(outfile)s;
-                   rm $picard_out;
+                   %(picard_options)s
                 '''
 
     P.run(statement)
 
+    PipelineScRnaseq.splitPicardOutput(picard_out, outfile)
+    os.remove(picard_out)
+
 
 @active_if(PAIRED)
 @merge(estimateLibraryComplexity,
@@ -1517,49 +1674,15 @@ def loadEstimateLibraryComplexity(infiles, outfile):
         P.run(statement)
 
 
-# ------------------- Picard: AlignmentSummaryMetrics ----------------------- #
-
-@follows(mkdir("qc.dir/alignment.summary.metrics.dir/"))
-@transform(collectBAMs,
-           regex(r".*/(.*).bam"),
-           (r"qc.dir/alignment.summary.metrics.dir"
-            r"/\1.alignment.summary.metrics"))
-def alignmentSummaryMetrics(infile, outfile):
-    '''
-    Run Picard AlignmentSummaryMetrics on the bam files.
-    '''
-
-    picard_options = PARAMS["picard_alignmentsummarymetric_options"]
-    validation_stringency = PARAMS["picard_validation_stringency"]
-
-    job_threads = PICARD_THREADS
-    job_memory = PICARD_MEMORY
-
-    reference_sequence = os.path.join(PARAMS["annotations_genome_dir"],
-                                      PARAMS["annotations_genome"] + ".fasta")
-
-    statement = '''picard_out=`mktemp -p %(cluster_tmpdir)s`;
-                   CollectAlignmentSummaryMetrics
-                   I=%(infile)s
-                   O=$picard_out
-                   REFERENCE_SEQUENCE=%(reference_sequence)s
-                   VALIDATION_STRINGENCY=%(validation_stringency)s
-                   %(picard_options)s;
-                   grep . $picard_out | grep -v "#"
-                   > %(outfile)s;
-                   rm $picard_out;
-                '''
-
-    P.run(statement)
-
-
-@merge(alignmentSummaryMetrics,
+@merge(collectMultipleMetrics,
        "qc.dir/qc_alignment_summary_metrics.load")
 def loadAlignmentSummaryMetrics(infiles, outfile):
     '''
     Load the complexity metrics to a single table in the project database.
     '''
 
+    infiles = [x[1] for x in infiles]
+
     P.concatenate_and_load(
         infiles, outfile,
         regex_filename=".*/.*/(.*).alignment.summary.metrics",
@@ -1567,64 +1690,7 @@ def loadAlignmentSummaryMetrics(infiles, outfile):
         options='-i "sample_id"')
 
 
-# ------------------- Picard: InsertSizeMetrics ----------------------- #
-
-@follows(mkdir("qc.dir/insert.size.metrics.dir/"))
-@transform(collectBAMs,
-           regex(r".*/(.*).bam"),
-           [(r"qc.dir/insert.size.metrics.dir"
-             r"/\1.insert.size.metrics.summary"),
-            (r"qc.dir/insert.size.metrics.dir"
-             r"/\1.insert.size.metrics.histogram")])
-def insertSizeMetricsAndHistograms(infile, outfiles):
-    '''
-    Run Picard InsertSizeMetrics on the BAM files to
-    collect summary metrics and histograms.'''
-
-    if PAIRED:
-        picard_summary, picard_histogram = outfiles
-        picard_histogram_pdf = picard_histogram + ".pdf"
-
-        if PARAMS["picard_insertsizemetric_options"]:
-            picard_options = PARAMS["picard_insertsizemetric_options"]
-        else:
-            picard_options = ""
-
-        job_threads = PICARD_THREADS
-        job_memory = PICARD_MEMORY
-
-        validation_stringency = PARAMS["picard_validation_stringency"]
-        reference_sequence = os.path.join(PARAMS["annotations_genome_dir"],
-                                          PARAMS["annotations_genome"] +
-                                          ".fasta")
-
-        statement = '''picard_out=`mktemp -p %(cluster_tmpdir)s`;
-                       CollectInsertSizeMetrics
-                       I=%(infile)s
-                       O=$picard_out
-                       HISTOGRAM_FILE=%(picard_histogram_pdf)s
-                       VALIDATION_STRINGENCY=%(validation_stringency)s
-                       REFERENCE_SEQUENCE=%(reference_sequence)s
-                       %(picard_options)s;
-                       grep "MEDIAN_INSERT_SIZE" -A 1 $picard_out
-                       > %(picard_summary)s;
-                       sed -e '1,/## HISTOGRAM/d' $picard_out
-                       > %(picard_histogram)s;
-                       rm $picard_out;
-                    '''
-
-    else:
-        picard_summary, picard_histogram = outfiles
-
-        statement = '''echo "Not compatible with SE data"
-                       > %(picard_summary)s;
-                       echo "Not compatible with SE data"
-                       > %(picard_histogram)s
-                    '''
-    P.run(statement)
-
-
-@merge(insertSizeMetricsAndHistograms,
+@merge(collectMultipleMetrics,
        "qc.dir/qc_insert_size_metrics.load")
 def loadInsertSizeMetrics(infiles, outfile):
     '''
@@ -1632,7 +1698,7 @@ def loadInsertSizeMetrics(infiles, outfile):
     '''
 
     if PAIRED:
-        picard_summaries = [x[0] for x in infiles]
+        picard_summaries = [x[2] for x in infiles]
 
         P.concatenate_and_load(picard_summaries, outfile,
                                regex_filename=(".*/.*/(.*)"
@@ -1647,7 +1713,7 @@ def loadInsertSizeMetrics(infiles, outfile):
         P.run(statement)
 
 
-@merge(insertSizeMetricsAndHistograms,
+@merge(collectMultipleMetrics,
        "qc.dir/qc_insert_size_histogram.load")
 def loadInsertSizeHistograms(infiles, outfile):
     '''
@@ -1655,14 +1721,15 @@ def loadInsertSizeHistograms(infiles, outfile):
     '''
 
     if PAIRED:
-        picard_histograms = [x[1] for x in infiles]
+        picard_histograms = [x[3] for x in infiles]
 
-        P.concatenate_and_load(
+        PipelineScRnaseq.bulkLoad(
             picard_histograms, outfile,
+            PARAMS["database_file"],
             regex_filename=(".*/.*/(.*)"
                             ".insert.size.metrics.histogram"),
             cat="sample_id",
-            options='-i "insert_size" -e')
+            index_cols=["insert_size"])
 
     else:
         statement = '''echo "Not compatible with SE data"
@@ -1671,38 +1738,37 @@ def loadInsertSizeHistograms(infiles, outfile):
         P.run(statement)
 
 
-# -------------- No. reads mapping to spike-ins vs genome ------------------- #
+# ------ No. reads mapping to spike-ins vs genome and fraction spliced ------ #
+
+# patterns for extracting the sample_id from the result file names
+SPIKE_VS_GENOME_RX = re.compile(r".*/.*/(.*)\.uniq\.mapped\.reads")
+FRACTION_SPLICED_RX = re.compile(r".*/.*/(.*)\.fraction\.spliced")
 
-@follows(mkdir("qc.dir/spike.vs.genome.dir"))
+@follows(indexBAMs,
+         mkdir("qc.dir/spike.vs.genome.dir"),
+         mkdir("qc.dir/fraction.spliced.dir/"))
 @transform(collectBAMs,
            regex(r".*/(.*).bam"),
-           r"qc.dir/spike.vs.genome.dir/\1.uniq.mapped.reads")
-def spikeVsGenome(infile, outfile):
-    '''
-    Summarise the number of reads mapping uniquely to spike-ins and genome.
-    Compute the ratio of reads mapping to spike-ins vs genome.
-    Only uniquely mapping reads are considered.'''
-
-    # TODO: do this from featureCounts instead
-
-    header = "\\t".join(["nreads_uniq_map_genome", "nreads_uniq_map_spike",
-                        "fraction_spike"])
-
-    statement = ''' echo -e "%(header)s" > %(outfile)s;
-                    samtools view %(infile)s
-                    | grep NH:i:1
-                    | awk 'BEGIN{OFS="\\t";spikein=0;genome=0};
-                           {total+=1};
-                           $3~/%(spikein_pattern)s*/{spikein+=1};
-                           END{frac=spikein/total;
-                               genome=total-spikein;
-                               print genome,spikein,frac};'
-                    >> %(outfile)s
-                '''
-    P.run(statement)
-
-
-@merge(spikeVsGenome,
+           [r"qc.dir/spike.vs.genome.dir/\1.uniq.mapped.reads",
+            r"qc.dir/fraction.spliced.dir/\1.fraction.spliced"])
+def uniqueReadCounts(infile, outfiles):
+    '''
+    Summarise the number of reads mapping uniquely to spike-ins and genome
+    and compute the ratio of reads mapping to spike-ins vs genome.
+    Compute the fraction of uniquely mapping reads containing a splice
+    junction (paired-endedness is ignored).
+    Both statistics are collected in a single pass over the BAM file.'''
+
+    P.submit(os.path.join(code_dir, "PipelineScRnaseq.py"),
+             "countUniqueReads",
+             args=[PARAMS["spikein_pattern"],
+                   PARAMS["spikein_bam_threads"]],
+             infiles=[infile],
+             outfiles=outfiles,
+             job_threads=PARAMS["spikein_bam_threads"])
+
+
+@merge(uniqueReadCounts,
        "qc.dir/qc_spike_vs_genome.load")
 def loadSpikeVsGenome(infiles, outfile):
     '''
@@ -1710,16 +1776,19 @@ def loadSpikeVsGenome(infiles, outfile):
     and fraction of spike-ins to a single table of the project database.
     '''
 
-    P.concatenate_and_load(infiles, outfile,
-                           regex_filename=".*/.*/(.*).uniq.mapped.reads",
-                           cat="sample_id",
-                           options='-i "sample_id"')
+    infiles = [x[0] for x in infiles]
+
+    PipelineScRnaseq.bulkLoad(infiles, outfile,
+                              PARAMS["database_file"],
+                              regex_filename=SPIKE_VS_GENOME_RX,
+                              cat="sample_id",
+                              index_cols=["sample_id"])
 
 
 # ------------------------- No. genes detected ------------------------------ #
 
 @active_if(fastqMode)
-@follows(mkdir("qc.dir/"), loadSalmonTPMs, loadEnsemblAnnotations)
+@follows(mkdir("qc.dir/"), loadSalmonTPMs, geneBiotypes)
 @files("salmon.dir/salmon.genes.tpms.load",
        "qc.dir/number.genes.detected.salmon")
 def numberGenesDetectedSalmon(infile, outfile):
@@ -1729,25 +1798,29 @@ def numberGenesDetectedSalmon(infile, outfile):
 
     table = P.to_table(infile)
 
-    statement = '''select distinct s.*, i.gene_biotype
-                   from %(table)s s
-                   inner join transcript_info i
-                   on s.gene_id=i.gene_id
-                ''' % locals()
+    statement = '''select * from %(table)s''' % locals()
 
     df = DB.fetch_DataFrame(statement, DATABASE)
 
-    melted_df = pd.melt(df, id_vars=["gene_id", "gene_biotype"])
+    # join the gene biotypes in memory rather than in sqlite
+    gene_biotypes = pd.read_csv("annotations.dir/gene_biotype.txt.gz",
+                                sep="\t", dtype={"gene_biotype": "category"})
 
-    grouped_df = melted_df.groupby(["gene_biotype", "variable"])
+    df = df.merge(gene_biotypes, on="gene_id", how="inner")
 
-    agg_df = grouped_df.agg({"value": lambda x:
-                             np.sum([1 for y in x if y > 0])})
-    agg_df.reset_index(inplace=True)
+    biotypes = df.pop("gene_biotype").to_numpy()
+    df.pop("gene_id")
 
-    count_df = pd.pivot_table(agg_df, index="variable",
-                              values="value", columns="gene_biotype")
-    count_df["total"] = count_df.apply(np.sum, 1)
+    # count the genes detected per sample on the wide (genes x samples)
+    # matrix rather than on a melted long format table
+    detected = df.to_numpy() > 0
+
+    count_df = pd.DataFrame(
+        {biotype: detected[biotypes == biotype].sum(axis=0)
+         for biotype in sorted(pd.unique(biotypes[pd.notnull(biotypes)]))},
+        index=df.columns)
+
+    count_df["total"] = count_df.sum(axis=1)
     count_df["sample_id"] = count_df.index
 
     count_df.to_csv(outfile, index=False, sep="\t")
@@ -1785,11 +1858,11 @@ def numberGenesDetectedFeatureCounts(infile, outfile):
 
     melted_df = DB.fetch_DataFrame(statement, DATABASE)
 
-    grouped_df = melted_df.groupby(["gene_biotype", "track"])
+    # count the genes detected with a vectorised comparison
+    melted_df["counts"] = melted_df["counts"] > 0
 
-    agg_df = grouped_df.agg({"counts": lambda x:
-                             np.sum([1 for y in x if y > 0])})
-    agg_df.reset_index(inplace=True)
+    agg_df = melted_df.groupby(["gene_biotype", "track"],
+                               as_index=False)["counts"].sum()
 
     count_df = pd.pivot_table(agg_df, index="track",
                               values="counts", columns="gene_biotype")
@@ -1812,41 +1885,20 @@ def loadNumberGenesDetectedFeatureCounts(infile, outfile):
 
 # --------------------- Fraction of spliced reads --------------------------- #
 
-@follows(mkdir("qc.dir/fraction.spliced.dir/"))
-@transform(collectBAMs,
-           regex(r".*/(.*).bam"),
-           r"qc.dir/fraction.spliced.dir/\1.fraction.spliced")
-def fractionReadsSpliced(infile, outfile):
-    '''
-    Compute fraction of reads containing a splice junction.
-    * paired-endedness is ignored
-    * only uniquely mapping reads are considered.
-    '''
-
-    statement = '''echo "fraction_spliced" > %(outfile)s;
-                   samtools view %(infile)s
-                   | grep NH:i:1
-                   | cut -f 6
-                   | awk '{if(index($1,"N")==0){us+=1}
-                           else{s+=1}}
-                          END{print s/(us+s)}'
-                   >> %(outfile)s
-                 '''
-
-    P.run(statement)
-
-
-@merge(fractionReadsSpliced,
+@merge(uniqueReadCounts,
        "qc.dir/qc_fraction_spliced.load")
 def loadFractionReadsSpliced(infiles, outfile):
     '''
     Load fractions of spliced reads to a single table of the project database.
     '''
 
-    P.concatenate_and_load(infiles, outfile,
-                           regex_filename=".*/.*/(.*).fraction.spliced",
-                           cat="sample_id",
-                           options='-i "sample_id"')
+    infiles = [x[1] for x in infiles]
+
+    PipelineScRnaseq.bulkLoad(infiles, outfile,
+                              PARAMS["database_file"],
+                              regex_filename=FRACTION_SPLICED_RX,
+                              cat="sample_id",
+                              index_cols=["sample_id"])
 
 
 # ---------------- Prepare a post-mapping QC summary ------------------------ #
@@ -1923,7 +1975,7 @@ def qcSummary(infiles, outfile):
 
     t1 = tables[0]
 
-    name_fields = PARAMS["name_field_titles"].strip()
+    name_fields = ",".join(NAME_FIELD_TITLES)
 
     stat_start = '''select distinct %(name_fields)s,
                                     sample_information.sample_id,
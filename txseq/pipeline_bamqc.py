@@ -57,6 +57,7 @@ import shutil
 import os
 from pathlib import Path
 import glob
+import csv
 import sqlite3
 
 import pandas as pd
@@ -516,16 +517,15 @@ def fractionSpliced(infile, sentinel):
     * only uniquely mapping reads are considered.
     '''
     
-    t = T.setup(infile, sentinel, PARAMS)
-
-    statement = '''echo "fraction_spliced" > %(out_file)s;
-                   samtools view %(infile)s
-                   | grep NH:i:1
-                   | cut -f 6
-                   | awk '{if(index($1,"N")==0){us+=1}
-                           else{s+=1}}
-                          END{print s/(us+s)}'
-                   >> %(out_file)s
+    t = T.setup(infile, sentinel, PARAMS,
+                memory=PARAMS["fraction_spliced_memory"],
+                cpu=PARAMS["fraction_spliced_threads"])
+
+    statement = '''python %(txseq_code_dir)s/python/bam_fraction_spliced.py
+                   --bam=%(infile)s
+                   --threads=%(job_threads)s
+                   --outfile=%(out_file)s
+                   &> %(log_file)s
                  ''' % dict(PARAMS, **t.var, **locals())
 
     P.run(statement, **t.resources)
@@ -541,10 +541,11 @@ def loadFractionSpliced(infiles, outfile):
     
     infiles = [x.replace(".sentinel","") for x in infiles]
 
-    P.concatenate_and_load(infiles, outfile,
-                           regex_filename=".*/.*/(.*).fraction.spliced",
-                           cat="sample_id",
-                           options='-i "sample_id"')
+    T.concatenate_to_db(infiles, outfile, PARAMS["sqlite_file"],
+                        regex_filename=".*/.*/(.*).fraction.spliced",
+                        cat="sample_id",
+                        index_cols=["sample_id"],
+                        dtype={"fraction_spliced": float})
 
 
 # ---------------- Prepare a post-mapping QC summary ------------------------ #
@@ -575,7 +576,7 @@ def qcSummary(infiles, outfile):
 
     # Some QC metrics are specific to paired end data
     if PAIRED:
-        exclude = []
+        exclude = set()
         paired_columns = '''PCT_READS_ALIGNED_IN_PAIRS
                                        as pct_reads_aligned_in_pairs,
                               MEDIAN_INSERT_SIZE
@@ -584,7 +585,7 @@ def qcSummary(infiles, outfile):
         pcat = "PAIR"
    
     else:
-        exclude = ["qc_library_complexity", "qc_insert_size_metrics"]
+        exclude = {"qc_library_complexity", "qc_insert_size_metrics"}
         paired_columns = ''
         pcat = "UNPAIRED"
 
@@ -600,8 +601,8 @@ def qcSummary(infiles, outfile):
 
     # ESTIMATED_LIBRARY_SIZE as library_size,
 
-    tables = [P.to_table(x) for x in infiles
-              if P.to_table(x) not in exclude]
+    tables = [t for t in (P.to_table(x) for x in infiles)
+              if t not in exclude]
 
     t1 = tables[0]
 
@@ -636,8 +637,16 @@ def qcSummary(infiles, outfile):
 
     statement = "\n".join([stat_start, join_stat, where_stat])
 
-    df = DB.fetch_DataFrame(statement, PARAMS["sqlite_file"])
-    df.to_csv(outfile, sep="\t", index=False)
+    # stream the rows straight from the cursor to the output file
+    con = sqlite3.connect(PARAMS["sqlite_file"])
+    cur = con.execute(statement)
+
+    with open(outfile, "w", newline="") as out_file:
+        writer = csv.writer(out_file, delimiter="\t")
+        writer.writerow([d[0] for d in cur.description])
+        writer.writerows(cur)
+
+    con.close()
 
 
 @transform(qcSummary,
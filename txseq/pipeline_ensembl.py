@@ -94,7 +94,7 @@ def extractYPAR(infile, outfile):
     on the Y chromosome
     '''
     
-    statement = '''grep Y %(infile)s > %(outfile)s
+    statement = '''awk -F'\\t' '$1=="Y"' %(infile)s > %(outfile)s
                 ''' % locals()
                 
     P.run(statement)
@@ -111,15 +111,20 @@ def hardMaskYPAR(infile, sentinel):
     
     y_par_bed = infile
     
-    t = T.setup(y_par_bed, sentinel, PARAMS)
+    t = T.setup(y_par_bed, sentinel, PARAMS,
+                cpu=PARAMS["bgzip_threads"])
 
-    
+    # the masked assembly is compressed as it is streamed out
+    # and then indexed (.fai and .gzi)
     statement = '''bedtools maskfasta
                    -fi <(zcat %(primary_assembly)s)
-                   -fo %(out_file)s
+                   -fo /dev/stdout
                    -bed %(y_par_bed)s
-                    &> %(log_file)s;
-                    gzip %(out_file)s;
+                    2> %(log_file)s
+                   | bgzip -@ %(job_threads)s -c
+                   > %(out_file)s.gz;
+                   samtools faidx %(out_file)s.gz
+                    2>> %(log_file)s
                 ''' % dict(PARAMS, **t.var, **locals())
                 
     P.run(statement, **t.resources)
@@ -138,8 +143,8 @@ def contigs(infile, sentinel):
     
     t = T.setup(assembly, sentinel, PARAMS)
     
-    statement = '''zgrep \> %(assembly)s
-                   | sed 's/>//g'
+    # the contig names are read from the index built by hardMaskYPAR
+    statement = '''cut -f1 %(assembly)s.fai
                    > %(out_file)s
                 ''' % dict(**t.var, **locals())
 
@@ -213,9 +218,14 @@ def transcriptToGeneMap(infile, sentinel):
 
     t = T.setup(gtf, sentinel, PARAMS)
         
-    statement='''zgrep transcript %(gtf)s
-                 | sed 's/.*gene_id "\\([^"]*\\)".*transcript_id "\\([^"]*\\)".*$/\\2\\\t\\1/g' 
-                 | sort -u > %(out_file)s
+    # emit each transcript_id, gene_id pair once, in GTF order
+    statement='''zcat %(gtf)s
+                 | awk 'BEGIN{FS="\\t"; OFS="\\t"}
+                        $3=="transcript"{
+                            g=$9; sub(/.*gene_id "/, "", g); sub(/".*/, "", g);
+                            t=$9; sub(/.*transcript_id "/, "", t); sub(/".*/, "", t);
+                            if(!((t, g) in seen)){seen[t, g]=1; print t, g}}'
+                 > %(out_file)s
               ''' % dict(PARAMS, **t.var, **locals())
     
     P.run(statement, **t.resources)
@@ -234,7 +244,7 @@ def transcriptInfo(infile, sentinel):
     t = T.setup(gtf, sentinel, PARAMS)
         
     statement='''python %(txseq_code_dir)s/python/ensembl_extract_gtf_attributes.py
-                 --ensemblgtf=%(geneset)s
+                 --ensemblgtf=%(gtf)s
                  --attributes=transcript_id,transcript_name,transcript_biotype,gene_id,gene_name,gene_biotype
                  --outfile=%(out_file)s
                  &> %(log_file)s
@@ -255,45 +265,35 @@ def api(infile, sentinel):
     if not os.path.exists("api.dir"):
         os.mkdir("api.dir")
 
-    pa = "ypar.masked.primary.assembly.fa.gz"
-    
-    if not os.path.exists(pa):
-        raise ValueError("ypar masked primary assembly file not found")
-    
-    os.symlink(os.path.join("..",pa), 
-               os.path.join("api.dir","txseq.genome.fa.gz"))
-    
-    txfa = "filtered.transcripts.fa.gz"
-    
-    if not os.path.exists(txfa):
-        raise ValueError("filtered transcript fasta file not found")
-        
-    os.symlink(os.path.join("..",txfa), 
-               os.path.join("api.dir","txseq.transcript.fa.gz"))
-    
-    gtf = "filtered.geneset.gtf.gz"
-    
-    if not os.path.exists(gtf):
-        raise ValueError("filtered geneset gtf file not found")
-        
-    os.symlink(os.path.join("..", gtf), 
-               os.path.join("api.dir","txseq.geneset.gtf.gz"))
-    
-    tx2gene = "transcript.to.gene.map"
-    
-    if not os.path.exists(tx2gene):
-        raise ValueError("transcript-to-gene map file not found")
-        
-    os.symlink(os.path.join("..", tx2gene), 
-               os.path.join("api.dir","txseq.transcript.to.gene.map"))
-    
-    txinfo = "transcript.info.tsv.gz"
-    
-    if not os.path.exists(txinfo):
-        raise ValueError("transcript info file not found")
-        
-    os.symlink(os.path.join("..", txinfo), 
-               os.path.join("api.dir","txseq.transcript.info.tsv.gz"))
+    # (source file, api name, description)
+    links = [("ypar.masked.primary.assembly.fa.gz",
+              "txseq.genome.fa.gz",
+              "ypar masked primary assembly"),
+             ("filtered.transcripts.fa.gz",
+              "txseq.transcript.fa.gz",
+              "filtered transcript fasta"),
+             ("filtered.geneset.gtf.gz",
+              "txseq.geneset.gtf.gz",
+              "filtered geneset gtf"),
+             ("transcript.to.gene.map",
+              "txseq.transcript.to.gene.map",
+              "transcript-to-gene map"),
+             ("transcript.info.tsv.gz",
+              "txseq.transcript.info.tsv.gz",
+              "transcript info")]
+
+    for src, dst, desc in links:
+
+        if not os.path.exists(src):
+            raise ValueError(desc + " file not found")
+
+        target = os.path.join("api.dir", dst)
+
+        # replace links left by a previous run
+        if os.path.lexists(target):
+            os.unlink(target)
+
+        os.symlink(os.path.join("..", src), target)
     
     IOTools.touch_file(sentinel)
 
@@ -113,7 +113,9 @@ def fastq_jobs():
 @files(fastq_jobs)
 def fastqc(infile, outfile):
     
-    t = T.setup(infile, outfile, PARAMS)
+    t = T.setup(infile, outfile, PARAMS,
+                memory=PARAMS["fastqc_memory"],
+                cpu=PARAMS["fastqc_threads"])
 
     seq_id = os.path.basename(outfile[:-len(".sentinel")])
 
@@ -138,6 +140,7 @@ def fastqc(infile, outfile):
 
     statement = '''fastqc 
                    -o %(out_path)s
+                   -t %(job_threads)s
                    --extract
                    %(contaminants)s
                    %(adaptors)s
@@ -146,7 +149,7 @@ def fastqc(infile, outfile):
                    > %(log_file)s
                 ''' % dict(PARAMS, **t.var, **locals())
                 
-    P.run(statement)
+    P.run(statement, **t.resources)
     IOTools.touch_file(outfile)
 
 
@@ -165,14 +168,17 @@ def summarizeFastQC(infiles, outfiles):
             os.path.join(track, "*_fastqc",
                          "fastqc_data.txt")))
 
+    # the fastqc outputs are parsed in parallel. This task runs on the
+    # submission host, so the pool size is taken from the configuration
+    workers = max(1, min(len(all_files), PARAMS["fastqc_read_threads"]))
+
     dfs = readqc.read_fastqc(
-        all_files)
+        all_files, workers=workers)
 
     for key, df in dfs.items():
         fn = re.sub("basic_statistics", key, outfiles[0])
         E.info("writing to {}".format(fn))
-        with IOTools.open_file(fn, "w") as outf:
-            df.to_csv(outf, sep="\t", index=True)
+        df.to_csv(fn, sep="\t", index=True, compression="gzip")
 
 
 @merge(fastqc, 
@@ -191,12 +197,12 @@ def buildFastQCSummaryStatus(infiles, outfile):
 def loadFastQC(infile, outfile):
     '''load FASTQC stats into database.'''
 
-    # a check to make sure file isn't empty
-    n = 0
+    # a check to make sure the file has data below the header
     with IOTools.open_file(infile) as f:
-        for i, line in enumerate(f):
-            n =+ i
-    if n > 0:
+        f.readline()
+        has_data = bool(f.readline())
+
+    if has_data:
         P.load(infile, outfile, options="--add-index=track")
     else:
         table_name = os.path.basename(infile).replace(".tsv.gz", "")
@@ -217,23 +223,29 @@ def loadMetadata(infile, outfile):
     
     db =sqlalchemy.create_engine('sqlite:///' + PARAMS["sqlite_file"])
 
-    with db.connect() as dbconn:
+    # insert several rows per statement while staying within the
+    # default sqlite limit of 999 bound variables per statement
+    def chunksize(df):
+        return max(1, 999 // len(df.columns))
+
+    # the tables and their indexes are committed in a single transaction
+    with db.begin() as dbconn:
 
         S.sample_table.to_sql(name = 'samples',
                               con= dbconn, 
                               index= False, 
-                              if_exists='replace') 
-    
-    
+                              if_exists='replace',
+                              method='multi',
+                              chunksize=chunksize(S.sample_table))
 
         dbconn.execute(text("CREATE INDEX samples_sample_id on samples (sample_id)"))
-        
-    with db.connect() as dbconn:
     
         S.fastq_table.to_sql(name = 'fastqs',
                             con= dbconn, 
                             index=False, 
-                            if_exists='replace') 
+                            if_exists='replace',
+                            method='multi',
+                            chunksize=chunksize(S.fastq_table))
 
         dbconn.execute(text("CREATE INDEX fastqs_fastq_id on fastqs (sample_id)"))
     
@@ -34,6 +34,7 @@ Requirements
 The following software is required:
 
 #. Subread
+#. bgzip (htslib)
 
 
 Output files
@@ -101,10 +102,11 @@ def count_jobs():
     
         yield([os.path.join(PARAMS["bam_path"], sample_id + ".bam"),
                 os.path.join("feature.counts.dir/",
-                            sample_id + ".counts.sentinel")])
+                            sample_id + ".counts.sentinel"),
+                sample_id])
 
 @files(count_jobs)
-def count(infile, sentinel):
+def count(infile, sentinel, sample_id):
     '''
     Run featureCounts.
     '''
@@ -112,7 +114,6 @@ def count(infile, sentinel):
     t = T.setup(infile, sentinel, PARAMS,
             cpu=PARAMS["featurecounts_threads"])
 
-    sample_id = os.path.basename(infile)[:-len(".bam")]
     sample = S.samples[sample_id]
 
     # set featureCounts options
@@ -143,15 +144,16 @@ def count(infile, sentinel):
                     -T %(featurecounts_threads)s
                     %(featurecounts_options)s
                     %(paired_options)s
-                    %(infile)s;
-                    cut -f1,7 $counts
-                    | grep -v "#" | grep -v "Geneid"
-                    | gzip -c > %(counts_file)s;
+                    %(infile)s
+                    &> %(log_file)s;
+                    awk 'BEGIN{FS=OFS="\\t"} !/^#/ && $1!="Geneid" {print $1, $7}'
+                        $counts
+                    | bgzip -@ %(job_threads)s -c > %(counts_file)s;
                     rm $counts;
                     mv ${counts}.summary %(summary_file)s;
                  ''' % dict(PARAMS, **t.var, **locals())
 
-    P.run(statement)
+    P.run(statement, **t.resources)
     IOTools.touch_file(sentinel)
 
 
@@ -162,34 +164,51 @@ def loadCounts(infiles, outfile):
     Combine and load count data in the project database.
     '''
     
-    infiles = [x.replace(".sentinel", ".gz") for x in infiles]
+    table = P.to_table(outfile)
+    database = DATABASE
 
-    P.concatenate_and_load(infiles, outfile,
-                           regex_filename=".*/(.*).counts.gz",
-                           has_titles=False,
-                           cat="track",
-                           header="track,gene_id,counts",
-                           options='-i "gene_id"',
-                           job_memory=PARAMS["sql_himem"])
+    # prefix the rows of each count file with the sample_id (track)
+    # and stream them all into a single sqlite .import
+    streams = "; ".join(
+        ["""pigz -dc %s | awk -v track=%s 'BEGIN{OFS="\\t"} {print track, $1, $2}'"""
+         % (x.replace(".sentinel", ".gz"),
+            os.path.basename(x)[:-len(".counts.sentinel")])
+         for x in infiles])
+
+    statement = '''{ %(streams)s; }
+                   | sqlite3 %(database)s
+                       "PRAGMA synchronous=NORMAL"
+                       "PRAGMA temp_store=MEMORY"
+                       "PRAGMA cache_size=-1048576"
+                       "DROP TABLE IF EXISTS %(table)s"
+                       "CREATE TABLE %(table)s
+                        (track TEXT, gene_id TEXT, counts INTEGER)"
+                       ".mode tabs"
+                       ".import /dev/stdin %(table)s"
+                       "CREATE INDEX %(table)s_gene_id ON %(table)s (gene_id)"
+                   &> %(outfile)s
+                ''' % locals()
 
+    P.run(statement)
 
-@files(loadCounts,
+
+@merge(count,
        "feature.counts.dir/featurecounts_counts.sentinel")
-def geneCounts(infile, outfile):
+def geneCounts(infiles, outfile):
     '''
-    Prepare a gene-by-sample table of featureCounts counts.
+    Prepare a gene-by-sample table of featureCounts counts directly
+    from the per-sample count files.
     '''
 
-    t = T.setup(infile, outfile, PARAMS,
+    t = T.setup(infiles[0], outfile, PARAMS,
                 memory="24G",
                 cpu=1)
-    table = P.to_table(infile)
 
-    database = DATABASE
+    count_files = ",".join([x.replace(".sentinel", ".gz")
+                            for x in infiles])
 
     statement = '''python %(txseq_code_dir)s/python/feature_counts_table.py
-                   --database=%(database)s
-                   --table=%(table)s
+                   --countfiles=%(count_files)s
                    --outfile=%(out_file)s.tsv.gz
                    &> %(log_file)s
                 ''' % dict(PARAMS, **t.var, **locals())
@@ -228,8 +247,9 @@ def loadTranscriptInfo(infile, outfile):
     if not os.path.exists(txinfo):
         raise ValueError("txseq annotations transcript information file not found")
 
-    # will use ~15G RAM
-    P.load(txinfo, outfile, options='-i "gene_id" -i "transcript_id"')
+    # the table is streamed in chunks rather than read into memory
+    T.load_chunked(txinfo, outfile, DATABASE,
+                   index_cols=["gene_id", "transcript_id"])
     
 
 @follows(loadTranscriptInfo)
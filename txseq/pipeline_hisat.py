@@ -35,6 +35,9 @@ Requirements
 The following software is required:
 
 #. Hisat2
+#. samtools
+#. bgzip (htslib)
+#. pigz
 
 
 Output files
@@ -57,6 +60,7 @@ import os
 from pathlib import Path
 import glob
 import sqlite3
+from functools import lru_cache
 
 import pandas as pd
 import numpy as np
@@ -93,35 +97,58 @@ if len(sys.argv) > 1:
     
 # ---------------------------- < hisat execution > -------------------------- #
 
+@lru_cache(maxsize=None)
+def hisat_fastq_input(sample_id):
+    '''
+    Return the hisat2 read arguments for a sample together with the
+    number of threads used to decompress them.
+
+    The FASTQ files are inflated with pigz and streamed to hisat2 by
+    process substitution, rather than being decompressed by hisat2's
+    single-threaded gzip reader. The result is cached so that the
+    arguments are built once per sample and shared by both passes.
+    '''
+
+    sample = S.samples[sample_id]
+
+    threads = PARAMS["hisat_decompression_threads"]
+
+    def stream(paths):
+        return "<(pigz -dc -p %s %s)" % (threads, " ".join(paths))
+
+    if sample.paired:
+        fastq_input = "-1 " + stream(sample.fastq["read1"]) +\
+                      " -2 " + stream(sample.fastq["read2"])
+        threads = threads * 2
+
+    else:
+        fastq_input = "-U " + stream(sample.fastq["read1"])
+
+    return fastq_input, threads
+
+
 def hisat_first_pass_jobs():
 
     for sample_id in S.samples.keys():
     
         yield([None,
                os.path.join("hisat.dir", "first.pass.dir",
-                            sample_id + ".sentinel"
-        )])
+                            sample_id + ".sentinel"),
+               sample_id])
 
 @files(hisat_first_pass_jobs)
-def firstPass(infile, sentinel):
+def firstPass(infile, sentinel, sample_id):
     '''
     Run a first hisat pass to identify novel splice sites.
     '''
 
-    t = T.setup(infile, sentinel, PARAMS,
-                memory=PARAMS["hisat_memory"],
-                cpu=PARAMS["hisat_threads"])
-    
-    sample_id = os.path.basename(sentinel)[:-len(".sentinel")]
-
     sample = S.samples[sample_id]
 
-    if sample.paired:
-        fastq_input = "-1 " + ",".join(sample.fastq["read1"]) +\
-                      " -2 " + ",".join(sample.fastq["read2"])
+    fastq_input, decompression_threads = hisat_fastq_input(sample_id)
 
-    else:
-        fastq_input = "-U " + ",".join(sample.fastq["read1"])
+    t = T.setup(infile, sentinel, PARAMS,
+                memory=PARAMS["hisat_memory"],
+                cpu=PARAMS["hisat_threads"] + decompression_threads)
     
     # known_ss = ""
     # if PARAMS["align_splice_sites"].lower() != "false":
@@ -149,7 +176,7 @@ def firstPass(infile, sentinel):
                         %(hisat_options)s
                         -S /dev/null
                         &> %(log_file)s;
-                    gzip %(novel_ss_outfile)s
+                    bgzip -@ %(job_threads)s %(novel_ss_outfile)s
                 ''' % dict(PARAMS, **t.var, **locals())
 
     P.run(statement, **t.resources)
@@ -163,22 +190,39 @@ def novelSpliceSites(infiles, sentinel):
     Collect the novel splice sites into a single file.
 '''
     t = T.setup(infiles[0], sentinel, PARAMS,
-            memory="4G", cpu=1)
+            memory=PARAMS["sort_memory"],
+            cpu=PARAMS["sort_threads"])
 
     junction_files = " ".join([x.replace(".sentinel",".novel.splice.sites.txt.gz") 
                                for x in infiles])
 
     out_path = sentinel.replace(".sentinel",".txt")
 
-    statement = '''mkdir -p tmp.dir;
-                   sort_dir=`mktemp -d -p tmp.dir`;
-                   zcat %(junction_files)s
-                   | sort -k1,1 -T $sort_dir
-                   | uniq
-                   > %(out_path)s;
-                   rm -rf $sort_dir
-                '''
-                
+    # whole-line uniqueness is required: keying on the contig alone
+    # would collapse all of the junctions on each contig
+    if PARAMS["sort_in_memory"]:
+
+        # hisat2 does not require the junctions to be sorted, so they
+        # are de-duplicated in a single pass with an awk hash
+        statement = '''pigz -dc -p %(job_threads)s %(junction_files)s
+                       | awk '!seen[$0]++'
+                       > %(out_path)s
+                    ''' % dict(PARAMS, **t.var, **locals())
+
+    else:
+
+        statement = '''mkdir -p tmp.dir;
+                       sort_dir=`mktemp -d -p tmp.dir`;
+                       pigz -dc -p %(job_threads)s %(junction_files)s
+                       | LC_ALL=C sort -u
+                           --parallel=%(job_threads)s
+                           -S %(sort_buffer)s
+                           --compress-program=pigz
+                           -T $sort_dir
+                       > %(out_path)s;
+                       rm -rf $sort_dir
+                    ''' % dict(PARAMS, **t.var, **locals())
+
     P.run(statement, **t.resources)
     IOTools.touch_file(sentinel) 
 
@@ -189,31 +233,25 @@ def hisat_second_pass_jobs():
     
         yield([None,
                os.path.join("hisat.dir",
-                            sample_id + ".sentinel")])
+                            sample_id + ".sentinel"),
+               sample_id])
 
 @follows(novelSpliceSites)
 @files(hisat_second_pass_jobs)
-def secondPass(infile, sentinel):
+def secondPass(infile, sentinel, sample_id):
     '''
     Align reads using HISAT with known and novel junctions.
     '''
 
-    t = T.setup(infile, sentinel, PARAMS,
-                memory=PARAMS["hisat_memory"],
-                cpu=PARAMS["hisat_threads"])
-    
-    sample_id = os.path.basename(sentinel)[:-len(".sentinel")]
-
     sample = S.samples[sample_id]
 
-    if sample.paired:
-        fastq_input = "-1 " + ",".join(sample.fastq["read1"]) +\
-                      " -2 " + ",".join(sample.fastq["read2"])
+    fastq_input, decompression_threads = hisat_fastq_input(sample_id)
 
-    else:
-        fastq_input = "-U " + ",".join(sample.fastq["read1"])
+    t = T.setup(infile, sentinel, PARAMS,
+                memory=PARAMS["hisat_memory"],
+                cpu=PARAMS["hisat_threads"] + decompression_threads)
 
-    novel_splice_sites = "hisat.dir/annotation/novel.splice.sites.txt"
+    novel_splice_sites = "hisat.dir/annotations/novel.splice.sites.txt"
 
     if sample.strand != "none":
         strand_param = "--rna-strandness %s" % sample.hisat_strand
@@ -232,9 +270,13 @@ def secondPass(infile, sentinel):
                       %(strand_param)s
                       %(hisat_options)s
                    2> %(log_file)s
-                   | samtools view - -bS
-                   | samtools sort - -T $sort_dir -o %(outfile)s >>%(log_file)s;
-                   samtools index %(outfile)s;
+                   | samtools sort
+                       -@ %(job_threads)s
+                       -m %(hisat_sort_memory)s
+                       -T $sort_dir
+                       -o %(outfile)s
+                       - >>%(log_file)s;
+                   samtools index -@ %(job_threads)s %(outfile)s;
                    rm -rf $sort_dir;
                  ''' % dict(PARAMS, **t.var, **locals())
 
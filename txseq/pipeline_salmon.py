@@ -35,6 +35,9 @@ Requirements
 The following software is required:
 
 #. Salmon
+#. pigz
+#. zstd (only if fastq recompress_zstd is set)
+#. rsync and flock (only if salmon index_scratch is set)
 
 Output files
 ------------
@@ -60,6 +63,8 @@ import shutil
 import os
 from pathlib import Path
 import glob
+import hashlib
+import json
 import sqlite3
 
 import pandas as pd
@@ -95,38 +100,131 @@ if len(sys.argv) > 1:
         # Set the database location
         DATABASE = PARAMS["sqlite"]["file"]
 
+        # Map the FASTQ files to their (optional) zstd recompressed copies
+        FASTQ_ZSTD = {fq["fastq_path"]: os.path.join("fastq.zstd.dir",
+                                                     seq_id + ".fastq.zst")
+                      for seq_id, fq in S.fastqs.items()}
+
 
 # ---------------------- < specific pipeline tasks > ------------------------ #
     
+# ----------------------- Optional FASTQ recompression ---------------------- #
+
+def recompress_jobs():
+
+    for fastq_path, zstd_path in FASTQ_ZSTD.items():
+
+        yield([fastq_path, zstd_path + ".sentinel"])
+
+@active_if(PARAMS["fastq_recompress_zstd"])
+@files(recompress_jobs)
+def recompressFASTQ(infile, outfile):
+    '''
+    Recompress the FASTQ files with zstd, which is much faster than
+    gzip to decompress, for projects that are quantified repeatedly.
+
+    The copy is written to a temporary file that is only moved into
+    place once it is complete.
+    '''
+
+    t = T.setup(infile, outfile, PARAMS,
+                cpu=PARAMS["fastq_zstd_threads"])
+
+    statement = '''pigz -dc %(infile)s
+                   | zstd -q -f -T%(job_threads)s -%(fastq_zstd_level)s
+                       -o %(out_file)s.tmp &&
+                   mv %(out_file)s.tmp %(out_file)s
+                ''' % dict(PARAMS, **t.var, **locals())
+
+    P.run(statement, **t.resources)
+
+    IOTools.touch_file(outfile)
+
+
 # ---------------------- Salmon TPM calculation ----------------------------- #
 
+def salmon_fastq_input(sample):
+    '''
+    Return the salmon read arguments for a sample together with the
+    number of threads used to decompress them.
+
+    The FASTQ files are inflated with pigz and streamed to salmon by
+    process substitution, rather than being decompressed by salmon's
+    single-threaded gzip reader. If the FASTQ files have been
+    recompressed with zstd, the zstd copies are streamed instead.
+    '''
+
+    threads = PARAMS["salmon_decompression_threads"]
+
+    def stream(paths):
+        if PARAMS["fastq_recompress_zstd"]:
+            return "<(zstd -dcq %s)" % " ".join([FASTQ_ZSTD[x] for x in paths])
+        return "<(pigz -dc -p %s %s)" % (threads, " ".join(paths))
+
+    if sample.paired:
+        fastq_input = "-1 " + stream(sample.fastq["read1"]) +\
+                      " -2 " + stream(sample.fastq["read2"])
+        threads = threads * 2
+
+    else:
+        fastq_input = "-r " + stream(sample.fastq["read1"])
+
+    return fastq_input, threads
+
+
+def salmon_index_input():
+    '''
+    Return the salmon index path to quantify against together with a
+    statement that stages the index to node-local scratch.
+
+    If salmon_index_scratch is set, the index is copied with rsync to
+    a folder of the scratch space named after the original index path.
+    The copy is kept between jobs, so later jobs on the same node only
+    check that it is up to date. A lock file stops concurrent jobs
+    from copying the index at the same time.
+    '''
+
+    index = PARAMS["txseq_salmon_index"]
+    scratch = PARAMS["salmon_index_scratch"]
+
+    if scratch in [None, False, "None", "none", "False", ""]:
+        return index, ""
+
+    key = hashlib.md5(os.path.abspath(index).encode()).hexdigest()[:12]
+    cache = os.path.join(scratch, "txseq.salmon.index." + key)
+
+    stage = '''mkdir -p %(cache)s &&
+               flock %(cache)s.lock
+                 rsync -a --delete %(index)s/ %(cache)s/ &&
+            ''' % locals()
+
+    return cache, stage
+
+
 def salmon_jobs():
 
     for sample_id in S.samples.keys():
     
         yield([None,
                os.path.join("salmon.dir",
-                            sample_id + ".sentinel"
-        )])
+                            sample_id + ".sentinel"),
+               sample_id])
 
+@follows(recompressFASTQ)
+@jobs_limit(PARAMS["salmon_concurrent_samples"], "salmon")
 @files(salmon_jobs)
-def quant(infile, outfile):
+def quant(infile, outfile, sample_id):
     '''
     Per sample quantitation using salmon.
     '''
     
-    t = T.setup(infile, outfile, PARAMS,
-                memory=PARAMS["salmon_memory"],
-                cpu=PARAMS["salmon_threads"])
+    sample = S.samples[sample_id]
 
-    sample = S.samples[os.path.basename(outfile)[:-len(".sentinel")]]
+    fastq_input, decompression_threads = salmon_fastq_input(sample)
 
-    if sample.paired:
-        fastq_input = "-1 " + " ".join(sample.fastq["read1"]) +\
-                      " -2 " + " ".join(sample.fastq["read2"])
-
-    else:
-        fastq_input = "-r " + " ".join(sample.fastq["read1"])
+    t = T.setup(infile, outfile, PARAMS,
+                memory=PARAMS["salmon_memory"],
+                cpu=PARAMS["salmon_threads"] + decompression_threads)
 
     options = ''
     if not PARAMS['salmon_quant_options'] is None:
@@ -138,8 +236,11 @@ def quant(infile, outfile):
 
     tx2gene = os.path.join(PARAMS["txseq_annotations"],"api.dir/txseq.transcript.to.gene.map")
 
-    statement = '''salmon quant -i %(txseq_salmon_index)s
-                                -p %(job_threads)s
+    index, stage_index = salmon_index_input()
+
+    statement = '''%(stage_index)s
+                   salmon quant -i %(index)s
+                                -p %(salmon_threads)s
                                 -g %(tx2gene)s
                                 %(options)s
                                 -l %(libtype)s
@@ -152,104 +253,198 @@ def quant(infile, outfile):
     
     IOTools.touch_file(outfile)
 
-@merge(quant, 
-       "salmon.dir/salmon.transcripts.sentinel")
-def loadSalmonTranscriptQuant(infiles, sentinel):
+def file_digest(path):
     '''
-    Load the salmon transcript-level results.
+    Return the blake2b digest of a file, read in blocks.
     '''
 
-    tables = [x.replace(".sentinel", "/quant.sf") for x in infiles]
+    digest = hashlib.blake2b(digest_size=16)
 
-    outfile = sentinel.replace(".sentinel",".load")
+    with open(path, "rb") as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            digest.update(block)
 
-    P.concatenate_and_load(tables, outfile,
-                           regex_filename=".*/(.*)/quant.sf",
-                           cat="sample_id",
-                           options="-i Name -i sample_id",
-                           job_memory=PARAMS["sql_himem"])
-    
-    IOTools.touch_file(sentinel)
+    return digest.hexdigest()
 
-@follows(loadSalmonTranscriptQuant)
-@merge(quant, "salmon.dir/salmon.genes.sentinel")
-def loadSalmonGeneQuant(infiles, sentinel):
-    '''
-    Load the salmon gene-level results.
-    '''
 
-    tables = [x.replace(".sentinel", "/quant.genes.sf") for x in infiles]
-    outfile = sentinel.replace(".sentinel",".load")
+def salmon_load_jobs():
 
-    P.concatenate_and_load(tables, outfile,
-                           regex_filename=".*/(.*)/quant.genes.sf",
-                           cat="sample_id",
-                           options="-i Name -i sample_id",
-                           job_memory=PARAMS["sql_himem"])
-    
-    IOTools.touch_file(sentinel)
+    sample_ids = list(S.samples.keys())
+
+    quant_sentinels = [os.path.join("salmon.dir", sample_id + ".sentinel")
+                       for sample_id in sample_ids]
+
+    for level in ["transcripts", "genes"]:
 
+        yield([quant_sentinels,
+               os.path.join("salmon.dir",
+                            "salmon." + level + ".sentinel"),
+               level,
+               sample_ids])
 
+@follows(quant)
 @jobs_limit(1)
-@transform([loadSalmonTranscriptQuant,
-            loadSalmonGeneQuant],
-           regex(r"(.*)/(.*).sentinel"),
-           r"\1/\2.tpms.sentinel")
-def salmonTPMs(infile, outfile):
+@files(salmon_load_jobs)
+def loadSalmonQuant(infiles, sentinel, level, sample_ids):
     '''
-    Prepare a wide table of salmon TPMs (samples x transcripts|genes).
+    Load the salmon transcript- or gene-level results into the project
+    database and prepare a wide table of TPMs (transcripts|genes x
+    samples).
+
+    Each quant.sf or quant.genes.sf file is read once by a single awk
+    process. awk skips the headers, prefixes the rows with the
+    sample_id (passed in the same order as the files) and streams them
+    into a pre-created typed table using the sqlite3 ".import" command.
+    At the same time it collects the TPMs, which are written out as the
+    wide flat file once all of the files are read.
+
+    A manifest of the quant file digests is kept next to the sentinel.
+    When the table has been loaded before, only the rows of samples
+    whose quant files have changed are deleted and re-imported, and
+    the rows of samples that are no longer present are removed.
+
+    In the project database the wide table is provided as a view of
+    the long format salmon table rather than as a second copy of the
+    data.
     '''
 
-    t = T.setup(infile, outfile, PARAMS,
-                memory="24G",
+    t = T.setup(infiles[0], sentinel, PARAMS,
+                memory=PARAMS["sql_himem"],
                 cpu=1)
 
-    table = P.to_table(infile.replace(".sentinel",".load"))
-    database = DATABASE
-
-    if "transcript" in table:
+    if level == "transcripts":
         id_name = "transcript_id"
-    elif "gene" in table:
+        quant_file = "quant.sf"
+    elif level == "genes":
         id_name = "gene_id"
+        quant_file = "quant.genes.sf"
     else:
         raise ValueError("Unexpected Salmon table name")
 
-    statement = '''python %(txseq_code_dir)s/python/salmon_fetch_tpms.py
-                   --database=%(database)s
-                   --table=%(table)s
-                   --idname=%(id_name)s
-                   --outfile=%(out_file)s.txt.gz
-                   &> %(log_file)s
+    tables = " ".join([os.path.join("salmon.dir", sample_id, quant_file)
+                       for sample_id in sample_ids])
+
+    sample_list = " ".join(sample_ids)
+
+    outfile = sentinel.replace(".sentinel", ".load")
+    table = P.to_table(outfile)
+    database = DATABASE
+
+    manifest_file = sentinel.replace(".sentinel", ".manifest.json")
+
+    digests = {sample_id: file_digest(os.path.join("salmon.dir", sample_id,
+                                                   quant_file))
+               for sample_id in sample_ids}
+
+    con = sqlite3.connect(DATABASE)
+    loaded = con.execute('''SELECT name FROM sqlite_master
+                            WHERE type='table' AND name=?''',
+                         (table,)).fetchone() is not None
+    con.close()
+
+    previous = {}
+    if loaded and os.path.exists(manifest_file):
+        with open(manifest_file) as manifest:
+            previous = json.load(manifest)
+
+    # the manifest is rewritten only once the load has succeeded
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+    if previous:
+        # update the rows of the changed and removed samples
+        load_ids = [x for x in sample_ids if previous.get(x) != digests[x]]
+        delete_ids = load_ids + [x for x in previous if x not in digests]
+
+        con = sqlite3.connect(DATABASE)
+
+        with con:
+            con.executemany("DELETE FROM %s WHERE sample_id=?" % table,
+                            [(x,) for x in delete_ids])
+
+        con.close()
+
+        prepare_sql = ""
+        index_sql = ""
+
+    else:
+        load_ids = sample_ids
+
+        prepare_sql = '''"DROP TABLE IF EXISTS %(table)s"
+                         "CREATE TABLE %(table)s
+                          (sample_id TEXT, Name TEXT, Length INTEGER,
+                           EffectiveLength REAL, TPM REAL, NumReads REAL)"
+                      ''' % locals()
+        index_sql = '''"CREATE INDEX %(table)s_Name
+                        ON %(table)s (Name, sample_id)"
+                       "CREATE INDEX %(table)s_sample_id
+                        ON %(table)s (sample_id)"
+                    ''' % locals()
+
+    load_list = " ".join(load_ids)
+
+    statement = '''awk -v id_name=%(id_name)s
+                       -v sample_ids="%(sample_list)s"
+                       -v load_ids="%(load_list)s"
+                       -v wide="gzip -c > %(out_file)s.tpms.txt.gz"
+                       'BEGIN{OFS="\\t"; split(sample_ids, samples, " ");
+                              n=split(load_ids, ids_to_load, " ");
+                              for (k=1; k<=n; k++) load[ids_to_load[k]]=1}
+                        FNR==1 {nsamples++; next}
+                        {if (samples[nsamples] in load)
+                           print samples[nsamples], $0;
+                         if (!($1 in seen)) {seen[$1]=1; ids[++nids]=$1};
+                         tpm[$1, nsamples]=$4}
+                        END {row=id_name;
+                             for (j=1; j<=nsamples; j++) row=row OFS samples[j];
+                             print row | wide;
+                             for (i=1; i<=nids; i++) {
+                               row=ids[i];
+                               for (j=1; j<=nsamples; j++)
+                                 row=row OFS tpm[ids[i], j];
+                               print row | wide};
+                             close(wide)}'
+                       %(tables)s
+                   | sqlite3 %(database)s
+                       "PRAGMA synchronous=NORMAL"
+                       "PRAGMA temp_store=MEMORY"
+                       "PRAGMA cache_size=-1048576"
+                       %(prepare_sql)s
+                       ".mode tabs"
+                       ".import /dev/stdin %(table)s"
+                       %(index_sql)s
+                   &> %(outfile)s
                 ''' % dict(PARAMS, **t.var, **locals())
-              
+
     P.run(statement, **t.resources)
-    
-    IOTools.touch_file(outfile)
 
+    view = table + "_tpms"
 
-@follows(loadSalmonGeneQuant)
-@jobs_limit(1)
-@transform(salmonTPMs,
-           suffix(".sentinel"),
-           ".load")
-def loadSalmonTPMs(infile, outfile):
-    '''
-    Load a wide table of salmon TPMs in the project database.
-    '''
+    columns = ",\n".join(
+        ["MAX(CASE WHEN sample_id='%s' THEN TPM END) AS \"%s\"" % (x, x)
+         for x in S.samples.keys()])
 
-    if "transcript" in infile:
-        id_name = "transcript_id"
-    elif "gene" in infile:
-        id_name = "gene_id"
-    else:
-        raise ValueError("Unexpected Salmon table name")
+    con = sqlite3.connect(DATABASE)
 
-    opts = "-i " + id_name
+    with con:
+        # replace the wide table or view left by a previous run
+        existing = con.execute('''SELECT type FROM sqlite_master
+                                  WHERE name=?''', (view,)).fetchone()
+        if existing is not None:
+            con.execute("DROP %s %s" % (existing[0].upper(), view))
 
-    file_name = infile[:-len(".sentinel")] + ".txt.gz"
+        con.execute('''CREATE VIEW %(view)s AS
+                       SELECT Name AS %(id_name)s,
+                              %(columns)s
+                       FROM %(table)s
+                       GROUP BY Name''' % locals())
 
-    P.load(file_name, outfile, options=opts,
-           job_memory=PARAMS["sql_himem"])
+    con.close()
+
+    with open(manifest_file, "w") as manifest:
+        json.dump(digests, manifest, indent=2)
+
+    IOTools.touch_file(sentinel)
 
 
 @follows(quant)
@@ -288,7 +483,7 @@ def tximeta(infile, outfile):
 
 # ----------------------- Quantitation target ------------------------------ #
 
-@follows(loadSalmonTPMs) #, loadCopyNumber)
+@follows(loadSalmonQuant) #, loadCopyNumber)
 def quantitation():
     '''
     Quantitation target.
@@ -298,7 +493,7 @@ def quantitation():
 
 # ----------------------- load txinfo ------------------------------ #
 
-@follows(loadSalmonTPMs)
+@follows(loadSalmonQuant)
 @files(None,
        "transcript.info.load")
 def loadTranscriptInfo(infile, outfile):
@@ -312,59 +507,77 @@ def loadTranscriptInfo(infile, outfile):
     if not os.path.exists(txinfo):
         raise ValueError("txseq annotations transcript information file not found")
 
-    # will use ~15G RAM
-    P.load(txinfo, outfile, options='-i "gene_id" -i "transcript_id"')
+    # the table is streamed in chunks rather than read into memory
+    T.load_chunked(txinfo, outfile, DATABASE,
+                   index_cols=["gene_id", "transcript_id"])
 
 
 # ------------------------- No. genes detected ------------------------------ #
 
 @jobs_limit(1)
-@follows(mkdir("qc.dir/"), loadSalmonTPMs, loadTranscriptInfo)
-@files("salmon.dir/salmon.genes.tpms.load",
-       "qc.dir/number.genes.detected.salmon.sentinel")
+@follows(mkdir("qc.dir/"), loadSalmonQuant, loadTranscriptInfo)
+@files("salmon.dir/salmon.genes.load",
+       "qc.dir/qc_no_genes_salmon.load")
 def numberGenesDetected(infile, outfile):
     '''
     Count no genes detected at copynumer > 0 in each sample.
+
+    The genes are counted for each biotype by a single sql aggregate
+    over the salmon gene table and the result is stored as a new table
+    of the project database.
     '''
 
-    t = T.setup(infile, outfile, PARAMS,
-            memory="24G",
-            cpu=1)
+    quant_table = P.to_table(infile)
+    table = P.to_table(outfile)
 
-    table = P.to_table(infile)
+    con = sqlite3.connect(DATABASE)
 
-    database = DATABASE
+    biotypes = [x for (x,) in con.execute('''SELECT DISTINCT gene_biotype
+                                             FROM transcript_info
+                                             WHERE gene_biotype IS NOT NULL
+                                             ORDER BY gene_biotype''')]
 
-    statement = '''python %(txseq_code_dir)s/python/salmon_no_genes_detected.py
-                   --database=%(database)s
-                   --table=%(table)s
-                   --outfile=%(out_file)s.tsv.gz
-                   &> %(log_file)s
-                ''' % dict(PARAMS, **t.var, **locals())
-              
-    P.run(statement, **t.resources)
-    
-    IOTools.touch_file(outfile)
+    # report every sample and biotype, including those with no genes
+    # detected. The biotypes are bound as parameters and the quotes of
+    # the column names are escaped.
+    columns = "".join(
+        ["SUM(CASE WHEN q.TPM > 0 AND i.gene_biotype=? THEN 1 ELSE 0 END)"
+         " AS \"%s\",\n" % x.replace('"', '""')
+         for x in biotypes])
 
-@follows(loadTranscriptInfo)
-@jobs_limit(1)
-@files(numberGenesDetected,
-       "qc.dir/qc_no_genes_salmon.load")
-def loadNumberGenesDetected(infile, outfile):
-    '''
-    Load the numbers of genes expressed to the project database.
-    '''
-    
-    P.load(infile[:-len(".sentinel")] + ".tsv.gz", 
-           outfile,
-           options='-i "sample_id"')
+    with con:
+        con.execute("DROP TABLE IF EXISTS %s" % table)
+
+        con.execute('''CREATE TABLE %(table)s AS
+                       SELECT q.sample_id,
+                              %(columns)s
+                              SUM(CASE WHEN q.TPM > 0 AND
+                                            i.gene_biotype IS NOT NULL
+                                       THEN 1 ELSE 0 END) AS total
+                       FROM %(quant_table)s q
+                       LEFT JOIN (SELECT DISTINCT gene_id, gene_biotype
+                                  FROM transcript_info) i
+                       ON q.Name=i.gene_id
+                       GROUP BY q.sample_id
+                       ORDER BY q.sample_id''' % locals(), biotypes)
+
+        con.execute("CREATE INDEX %(table)s_sample_id ON %(table)s (sample_id)"
+                    % locals())
+
+        nrows = con.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+
+    con.close()
+
+    with open(outfile, "w") as out_file:
+        out_file.write("counted the genes detected in %i samples into %s\n"
+                       % (nrows, table))
 
 
 # --------------------- < generic pipeline tasks > -------------------------- #
 
 @follows(quantitation, 
          tximeta,
-         loadNumberGenesDetected)
+         numberGenesDetected)
 def full():
     pass
 
@@ -9,10 +9,12 @@ Core components:
 * `parameters`_
 * `setup`_
 * `samples`_
+* `database`_
 
 Pipeline specific components:
 
 * `readqc`_
+* `bam`_
 
 
 '''
@@ -22,4 +24,5 @@ Pipeline specific components:
 
 from txseq.tasks.setup import *
 from txseq.tasks.parameters import *
-from txseq.tasks.samples import *
\ No newline at end of file
+from txseq.tasks.samples import *
+from txseq.tasks.database import *
\ No newline at end of file
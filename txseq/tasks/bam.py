@@ -0,0 +1,29 @@
+'''
+bam.py
+======
+
+Overview
+--------
+
+Helper functions for inspecting BAM alignments.
+
+Functions
+---------
+
+'''
+
+
+# CIGAR operation code for "N" (skipped region from the reference)
+BAM_CREF_SKIP = 3
+
+
+# --------------------------------- Functions -------------------------------- #
+
+
+def is_spliced(read):
+    '''
+    Return True if the pysam aligned segment `read` skips a region of
+    the reference (a CIGAR "N" operation), i.e. the read is spliced.
+    '''
+
+    return any(op == BAM_CREF_SKIP for op, _ in read.cigartuples or ())
@@ -0,0 +1,155 @@
+'''
+database.py
+===========
+
+Overview
+--------
+
+Helper functions for loading pipeline results into the sqlite database.
+
+Functions
+---------
+
+'''
+
+import re
+import sqlite3
+import pandas as pd
+from cgatcore import pipeline as P
+
+
+# --------------------------------- Functions -------------------------------- #
+
+
+def _create_indexes(con, table, index_cols):
+    '''
+    Create a single column index on `table` for each of the `index_cols`.
+    '''
+
+    for col in index_cols:
+        con.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s ("%s")'
+                    % (table, col, table, col))
+
+
+def index_table(database, table, index_cols):
+    '''
+    Index an existing table of the sqlite database.
+
+    Tables loaded without indexes (e.g. with ``P.load`` and no ``-i``
+    options) can be indexed once the data is in place, which is
+    cheaper than maintaining the indexes during the load.
+    '''
+
+    con = sqlite3.connect(database)
+
+    with con:
+        _create_indexes(con, table, index_cols)
+
+    con.close()
+
+
+def concatenate_to_db(infiles, outfile, database, regex_filename,
+                      cat="sample_id", index_cols=None, dtype=None,
+                      names=None):
+    '''
+    Concatenate a set of tab-separated tables and load them into a
+    single table of the sqlite database.
+
+    The tables are read with pandas, a `cat` column is populated
+    from the first group of `regex_filename` matched against each
+    file name, and the combined table is inserted in one transaction.
+    Indexes are created for the `index_cols` once the data is loaded.
+    The table is named after the `outfile`, which is written as a
+    record of the load.
+
+    If `names` are given, the tables are read as having no header
+    line and the columns are named accordingly.
+    '''
+
+    rx = re.compile(regex_filename)
+
+    tables = []
+    for infile in infiles:
+        df = pd.read_csv(infile, sep="\t", engine="c", dtype=dtype,
+                         names=names)
+        df.insert(0, cat, rx.search(infile).groups()[0])
+        tables.append(df)
+
+    df = pd.concat(tables, ignore_index=True)
+
+    table = P.to_table(outfile)
+
+    con = sqlite3.connect(database)
+
+    # these settings only apply to this connection. WAL journaling is
+    # not enabled as it is unreliable on network file systems.
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-1048576")
+
+    # insert several rows per statement while staying within the
+    # default sqlite limit of 999 bound variables per statement
+    with con:
+        df.to_sql(table, con, if_exists="replace", index=False,
+                  method="multi", chunksize=max(1, 999 // len(df.columns)))
+
+        _create_indexes(con, table, index_cols or [])
+
+    con.close()
+
+    with open(outfile, "w") as out_file:
+        out_file.write("loaded %i rows from %i files into %s\n"
+                       % (len(df), len(infiles), table))
+
+
+def load_chunked(infile, outfile, database, index_cols=None,
+                 chunksize=50000):
+    '''
+    Stream a (optionally gzipped) tab-separated table into a table of
+    the sqlite database.
+
+    The table is created from the column types of the first chunk and
+    the chunks are inserted with a single prepared statement within one
+    transaction, so only one chunk is held in memory at a time. The
+    table is named after the `outfile`, which is written as a record of
+    the load. Indexes are created for the `index_cols` once the data is
+    loaded.
+    '''
+
+    table = P.to_table(outfile)
+
+    reader = pd.read_csv(infile, sep="\t", engine="c",
+                         chunksize=chunksize)
+
+    con = sqlite3.connect(database)
+
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-1048576")
+
+    nrows = 0
+
+    with con:
+        for i, chunk in enumerate(reader):
+
+            if i == 0:
+                chunk.head(0).to_sql(table, con, if_exists="replace",
+                                     index=False)
+
+                insert = 'INSERT INTO %s VALUES (%s)' % (
+                    table, ",".join(["?"] * len(chunk.columns)))
+
+            # object conversion gives python scalars and None for NaN
+            rows = chunk.astype(object).where(chunk.notna(), None)
+
+            con.executemany(insert, rows.values.tolist())
+            nrows += len(chunk)
+
+        _create_indexes(con, table, index_cols or [])
+
+    con.close()
+
+    with open(outfile, "w") as out_file:
+        out_file.write("loaded %i rows from %s into %s\n"
+                       % (nrows, infile, table))
+
@@ -15,6 +15,7 @@ import os
 import re
 import glob
 import collections
+from concurrent.futures import ProcessPoolExecutor
 from io import StringIO
 import pandas as pd
 from pathlib import Path
@@ -245,38 +246,71 @@ def buildExperimentReadQuality(infiles, outfile, datadir):
     df_out.to_csv(iotools.open_file(outfile, "w"), sep="\t")
 
 
-def read_fastqc(infiles):
+def read_fastqc_file(infile):
+    """read the sections of a single fastqc output file into dataframes.
+
+    Arguments
+    ---------
+    infile : string
+        Input filename with fastqc output.
+
+    Returns
+    -------
+    track : string
+        Track name derived from the filename.
+    dataframes : dict
+        One dataframe per section, keyed by section name.
+    """
+
+    track = fastqc_filename2track(infile)
+    sample_id = Path(infile).parts[-3]
+
+    dfs = {}
+    with iotools.open_file(infile) as inf:
+        for name, status, header, data in FastqcSectionIterator(inf):
+            records = (x.split("\t") for x in data)
+            df = pd.DataFrame.from_records(records, columns=header.split("\t"))
+            df["sample_id"] = sample_id
+            dfs[name] = df
+
+    return track, dfs
+
+
+def read_fastqc(infiles, workers=1):
     """merge multiple fastq output into multiple dataframes.
 
+    The files are parsed independently, in a pool of `workers`
+    processes if more than one is requested.
+
     Arguments
     ---------
-    infiles : string
-        Input filename with fastqscreen output.
-    regex_track: string
-        Regular expression to extract track name from filename.
-    sep: char
-        Separator for merging multiple capture groups in regex.
+    infiles : list
+        Input filenames with fastqc output.
+    workers : int
+        Number of processes used to parse the files.
 
     Returns
     -------
     dataframes
     """
 
-    dfs, tracks = collections.defaultdict(list), []
-    for infile in infiles:
-        track = fastqc_filename2track(infile)
-        sample_id = Path(infile).parts[-3]
-        tracks.append(track)
-        with iotools.open_file(infile) as inf:
-            for name, status, header, data in FastqcSectionIterator(inf):
-                records = (x.split("\t") for x in data)
-                df = pd.DataFrame.from_records(records, columns=header.split("\t"))
-                df["sample_id"] = sample_id
-                dfs[name].append(df)
+    if workers > 1 and len(infiles) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(read_fastqc_file, infiles))
+    else:
+        parsed = [read_fastqc_file(infile) for infile in infiles]
+
+    # sections can be missing from individual files, so the track
+    # keys are collected per section
+    dfs, tracks = collections.defaultdict(list), collections.defaultdict(list)
+    for track, sections in parsed:
+        for name, df in sections.items():
+            dfs[name].append(df)
+            tracks[name].append(track)
 
     result = {}
     for key, dd in dfs.items():
-        df = pd.concat(dd, keys=tracks, names=["track"])
+        df = pd.concat(dd, keys=tracks[key], names=["track"])
         df.index = df.index.droplevel(1)
         key = re.sub(" ", "_", key.lower())
         result[key] = df